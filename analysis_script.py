@@ -1,3 +1,4 @@
+import sys
 import json
 import re
 from pathlib import Path
@@ -135,10 +136,12 @@ def flatten_dict(d, prefix='') -> List[str]:
             paths.append(new_key)
     return paths
 
-def analyze_images() -> Dict[str, Any]:
+def analyze_images(ground_truth_dir: str = 'ground_truth/output', benchmark_dir: str = 'benchmark_data',
+                   models: List[str] = None) -> Dict[str, Any]:
     """Process all images and return analysis results"""
     # Get list of images
-    ground_truth_dir = Path('ground_truth/output')
+    ground_truth_dir = Path(ground_truth_dir)
+    models = MODEL_NAMES if models is None else models
     results = {}
     
     for gt_file in ground_truth_dir.glob('*.json'):
@@ -153,9 +156,9 @@ def analyze_images() -> Dict[str, Any]:
         
         # Load results for each model
         model_results = {}
-        for model in MODEL_NAMES:
+        for model in models:
             try:
-                with open(f"benchmark_data/{model}/{image_id}.json") as f:
+                with open(f"{benchmark_dir}/{model}/{image_id}.json") as f:
                     data = json.load(f)
                     model_results[model] = data['annotations']
                     field_paths.extend(flatten_dict(data['annotations']))
@@ -298,74 +301,144 @@ def analyze_images() -> Dict[str, Any]:
             
     return results
 
-def generate_summary() -> Dict[str, Any]:
+def model_rates(analyses: Dict[str, ImageAnalysis], model: str) -> Dict[str, float]:
+    """Accuracy, incorrect transcription and missing rates of a model over all images"""
+    total_correct = 0
+    total_incorrect_transcription = 0
+    total_missing = 0
+    total_fields = 0
+    
+    # Sum up metrics across all images
+    for analysis in analyses.values():
+        if model in analysis.metrics:
+            metrics = analysis.metrics[model]
+            total_correct += metrics['correct']
+            total_incorrect_transcription += metrics['incorrect_transcription']
+            total_missing += metrics['missing']
+            total_fields += sum(metrics.values())
+    
+    # Calculate rates
+    if total_fields == 0:
+        return {}
+    return {
+        "accuracy": total_correct / total_fields,
+        "incorrect_transcription_rate": total_incorrect_transcription / total_fields,
+        "missing_rate": total_missing / total_fields
+    }
+
+def generate_summary(ground_truth_dir: str = 'ground_truth/output', benchmark_dir: str = 'benchmark_data',
+                     models: List[str] = None, breakdown: bool = False) -> Dict[str, Any]:
     """Generate final summary with metrics"""
     print("Starting analysis...")
     
     # Load benchmark info
-    with open('benchmark_data/benchmark_summary.json') as f:
+    with open(f'{benchmark_dir}/benchmark_summary.json') as f:
         benchmark_summary = json.load(f)
         
     # Get analysis results
-    analyses = analyze_images()
+    analyses = analyze_images(ground_truth_dir, benchmark_dir, models)
     
     # Calculate overall metrics
     overall_metrics = {}
     for model in benchmark_summary.keys():
-        total_correct = 0
-        total_incorrect_transcription = 0
-        total_missing = 0
-        total_fields = 0
-        
-        # Sum up metrics across all images
-        for analysis in analyses.values():
-            if model in analysis.metrics:
-                metrics = analysis.metrics[model]
-                total_correct += metrics['correct']
-                total_incorrect_transcription += metrics['incorrect_transcription']
-                total_missing += metrics['missing']
-                total_fields += sum(metrics.values())
-        
-        # Calculate rates
-        if total_fields > 0:
+        rates = model_rates(analyses, model)
+        if rates:
             overall_metrics[model] = {
-                "accuracy": total_correct / total_fields,
-                "incorrect_transcription_rate": total_incorrect_transcription / total_fields,
-                "missing_rate": total_missing / total_fields,
+                **rates,
                 "cost_per_image": benchmark_summary[model]["average_cost_per_image"],
                 "time_per_image": benchmark_summary[model]["average_time_per_image"],
                 "total_cost": benchmark_summary[model]["total_cost"],
                 "total_time": benchmark_summary[model]["total_time"]
             }
     
-    return {
-        "overall_metrics": overall_metrics,
-        "analyses": {
-            image_id: {
-                "image_id": analysis.image_id,
-                "front_url": analysis.front_url,
-                "back_url": analysis.back_url,
-                "fields": [
-                    {
-                        "field_path": field.field_path,
-                        "ground_truth": field.ground_truth,
-                        "model_values": field.model_values,
-                        "status": field.status,
-                        "is_list_item": field.is_list_item,
-                        "parent_path": field.parent_path,
-                        "list_index": field.list_index
-                    }
-                    for field in analysis.fields
-                ],
-                "metrics": analysis.metrics
-            }
-            for image_id, analysis in analyses.items()
+    summary = {"overall_metrics": overall_metrics}
+    if breakdown:
+        # Per-field-path, per-section and per-side accuracy (requires numpy)
+        from metrics_matrix import breakdowns
+        summary["breakdowns"] = breakdowns(analyses)
+
+    summary["analyses"] = {
+        image_id: {
+            "image_id": analysis.image_id,
+            "front_url": analysis.front_url,
+            "back_url": analysis.back_url,
+            "fields": [
+                {
+                    "field_path": field.field_path,
+                    "ground_truth": field.ground_truth,
+                    "model_values": field.model_values,
+                    "status": field.status,
+                    "is_list_item": field.is_list_item,
+                    "parent_path": field.parent_path,
+                    "list_index": field.list_index
+                }
+                for field in analysis.fields
+            ],
+            "metrics": analysis.metrics
         }
+        for image_id, analysis in analyses.items()
     }
+    return summary
+
+def compare_prompt_variants(prompts_dir: str = 'benchmark_data/prompts',
+                            ground_truth_dir: str = 'ground_truth/output') -> Dict[str, Dict[str, Any]]:
+    """Accuracy, cost and latency per prompt variant and model from a `process_images.py matrix` run"""
+    prompts_dir = Path(prompts_dir)
+    index_file = prompts_dir / 'index.json'
+    index = json.loads(index_file.read_text()) if index_file.exists() else {}
+
+    comparison = {}
+    for summary_file in sorted(prompts_dir.glob('*/benchmark_summary.json')):
+        variant_dir = summary_file.parent
+        with open(summary_file) as f:
+            benchmark_summary = json.load(f)
+        analyses = analyze_images(ground_truth_dir, str(variant_dir), list(benchmark_summary))
+        comparison[variant_dir.name] = {
+            "prompt_file": index.get(variant_dir.name),
+            "models": {
+                model: {
+                    "accuracy": model_rates(analyses, model).get("accuracy"),
+                    "cost_per_image": stats["average_cost_per_image"],
+                    "time_per_image": stats["average_time_per_image"],
+                    "failed_images": len(stats["failed_images"])
+                }
+                for model, stats in benchmark_summary.items()
+            }
+        }
+    return comparison
+
+def print_prompt_comparison(comparison: Dict[str, Dict[str, Any]]):
+    print(f"{'prompt':<28} {'model':<30} {'accuracy':>9} {'cost/image':>11} {'time/image':>11}")
+    for digest, variant in comparison.items():
+        label = f"{digest} ({Path(variant['prompt_file']).name})" if variant['prompt_file'] else digest
+        for model, row in variant['models'].items():
+            accuracy = "-" if row['accuracy'] is None else f"{row['accuracy']:.1%}"
+            print(f"{label:<28} {model:<30} {accuracy:>9} {row['cost_per_image']:>11.4f} {row['time_per_image']:>10.2f}s")
 
 if __name__ == "__main__":
+    # Compare prompt variants from a `process_images.py matrix` run instead of the usual analysis
+    if "--compare-prompts" in sys.argv:
+        index = sys.argv.index("--compare-prompts")
+        prompts_dir = sys.argv[index + 1] if len(sys.argv) > index + 1 else 'benchmark_data/prompts'
+        comparison = compare_prompt_variants(prompts_dir)
+        print_prompt_comparison(comparison)
+        with open("prompt_comparison.json", 'w') as f:
+            json.dump(comparison, f, indent=2)
+        sys.exit(0)
+
+    # Optional profiling: --profile <file.prof> (cProfile) and/or --sample <file.txt> (collapsed stacks)
+    profile_path = sys.argv[sys.argv.index("--profile") + 1] if "--profile" in sys.argv else None
+    sample_path = sys.argv[sys.argv.index("--sample") + 1] if "--sample" in sys.argv else None
+
+    # --breakdown adds per-field-path/section/side accuracy tables to analysis.json
+    breakdown = "--breakdown" in sys.argv
+
     # Generate analysis and save to file
-    summary = generate_summary()
+    if profile_path or sample_path:
+        from tracing import profile_call
+        summary = profile_call(lambda: generate_summary(breakdown=breakdown), profile_path, sample_path)
+    else:
+        summary = generate_summary(breakdown=breakdown)
     print("Writing results...")
     with open("analysis.json", 'w') as f:
         json.dump(summary, f, indent=2)
@@ -0,0 +1,87 @@
+"""JSON schema for model annotations, derived from the ground truth.
+
+Usage:
+    python annotation_schema.py    # regenerate annotation_schema.json from ground_truth/output
+
+The schema is the union of the structures found in ground_truth/output. No
+field is required, matching the prompt's "only include populated fields".
+Providers that support structured output receive it (see providers.py);
+to_gemini_schema() converts it to the OpenAPI subset Gemini accepts.
+"""
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+SCHEMA_FILE = Path(__file__).resolve().parent / "annotation_schema.json"
+
+JSON_TYPES = {str: "string", bool: "boolean", int: "integer", float: "number", type(None): "null"}
+
+def _merge(schema: Dict[str, Any], value: Any) -> Dict[str, Any]:
+    """Widen `schema` so that it also accepts `value`"""
+    if isinstance(value, dict):
+        schema.setdefault("type", "object")
+        properties = schema.setdefault("properties", {})
+        for key, item in value.items():
+            properties[key] = _merge(properties.get(key, {}), item)
+        return schema
+    if isinstance(value, list):
+        schema.setdefault("type", "array")
+        items = schema.get("items", {})
+        for item in value:
+            items = _merge(items, item)
+        schema["items"] = items
+        return schema
+
+    value_type = JSON_TYPES.get(type(value), "string")
+    if "type" not in schema:
+        schema["type"] = value_type
+        return schema
+    existing = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+    if value_type not in existing:
+        schema["type"] = existing + [value_type]
+    return schema
+
+def _fill_empty_items(schema: Dict[str, Any]):
+    # Lists that are always empty in the ground truth are assumed to hold strings
+    if schema.get("type") == "array" and not schema.get("items"):
+        schema["items"] = {"type": "string"}
+    children = list(schema.get("properties", {}).values())
+    if "items" in schema:
+        children.append(schema["items"])
+    for child in children:
+        _fill_empty_items(child)
+
+def derive_schema(ground_truth_dir: str = 'ground_truth/output') -> Dict[str, Any]:
+    schema: Dict[str, Any] = {}
+    for gt_file in sorted(Path(ground_truth_dir).glob('*.json')):
+        with open(gt_file) as f:
+            schema = _merge(schema, json.load(f))
+    _fill_empty_items(schema)
+    return {"$schema": "http://json-schema.org/draft-07/schema#", "title": "Photograph annotations", **schema}
+
+@lru_cache(maxsize=None)
+def load_schema() -> Dict[str, Any]:
+    with open(SCHEMA_FILE) as f:
+        return json.load(f)
+
+def to_gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert to Gemini's OpenAPI subset: single types with `nullable`, no draft keywords"""
+    converted: Dict[str, Any] = {}
+    types = schema.get("type", "string")
+    types = types if isinstance(types, list) else [types]
+    non_null = [t for t in types if t != "null"] or ["string"]
+    converted["type"] = non_null[0]
+    if "null" in types:
+        converted["nullable"] = True
+    if "properties" in schema:
+        converted["properties"] = {key: to_gemini_schema(value) for key, value in schema["properties"].items()}
+    if "items" in schema:
+        converted["items"] = to_gemini_schema(schema["items"])
+    return converted
+
+if __name__ == "__main__":
+    schema = derive_schema()
+    with open(SCHEMA_FILE, 'w') as f:
+        json.dump(schema, f, indent=2)
+    print(f"Wrote {SCHEMA_FILE.name}")
@@ -0,0 +1,165 @@
+"""Shared benchmark artifacts: run statistics, result files, locked summary
+updates and shard bookkeeping.
+
+Several `process_images.py` invocations may run at once, on one machine or
+split across machines with `--shard i/N`. The summary file is only ever
+rewritten under an exclusive lock, after re-reading it, and shards write
+their raw statistics to benchmark_data/shards/ for `merge` to combine.
+"""
+import os
+import json
+import tempfile
+import contextlib
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from tracing import span
+from tolerant_json import PARSE_FAILED, PARSE_REPAIRED
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SHARD_DIR = "shards"
+
+class BenchmarkStats:
+    def __init__(self):
+        self.total_cost = 0.0
+        self.total_time = 0
+        self.total_tokens = 0
+        self.processed_images = 0
+        self.failed_images = []
+        # Paid responses whose JSON could not be parsed, or needed repairing
+        self.parse_failures = 0
+        self.repaired_outputs = 0
+
+    def update(self, result: Dict[str, Any]):
+        self.total_cost += result['cost']
+        self.total_time += result['request_time']
+        self.total_tokens += result['total_tokens']
+        self.processed_images += 1
+        parse_status = result.get('parse_status')
+        self.parse_failures += parse_status == PARSE_FAILED
+        self.repaired_outputs += parse_status == PARSE_REPAIRED
+
+    def add_failure(self, image_id: str, error: str, cost: float = 0.0, tokens: int = 0):
+        # cost/tokens: calls that were paid for before the failure, e.g. earlier cascade stages
+        self.failed_images.append({"image_id": image_id, "error": str(error)})
+        self.total_cost += cost
+        self.total_tokens += tokens
+
+    def merge(self, other: "BenchmarkStats"):
+        self.total_cost += other.total_cost
+        self.total_time += other.total_time
+        self.total_tokens += other.total_tokens
+        self.processed_images += other.processed_images
+        self.failed_images.extend(other.failed_images)
+        self.parse_failures += other.parse_failures
+        self.repaired_outputs += other.repaired_outputs
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Unrounded state, so shards can be merged exactly"""
+        return {
+            "total_cost": self.total_cost,
+            "total_time": self.total_time,
+            "total_tokens": self.total_tokens,
+            "processed_images": self.processed_images,
+            "failed_images": self.failed_images,
+            "parse_failures": self.parse_failures,
+            "repaired_outputs": self.repaired_outputs
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BenchmarkStats":
+        stats = cls()
+        stats.total_cost = data["total_cost"]
+        stats.total_time = data["total_time"]
+        stats.total_tokens = data["total_tokens"]
+        stats.processed_images = data["processed_images"]
+        stats.failed_images = list(data["failed_images"])
+        stats.parse_failures = data.get("parse_failures", 0)
+        stats.repaired_outputs = data.get("repaired_outputs", 0)
+        return stats
+
+    def get_summary(self) -> Dict[str, Any]:
+        return {
+            "total_cost": round(self.total_cost, 4),
+            "total_time": self.total_time,
+            "total_tokens": self.total_tokens,
+            "processed_images": self.processed_images,
+            "average_cost_per_image": round(self.total_cost / max(1, self.processed_images), 4),
+            "average_time_per_image": round(self.total_time / max(1, self.processed_images), 2),
+            "failed_images": self.failed_images,
+            "parse_failures": self.parse_failures,
+            "repaired_outputs": self.repaired_outputs
+        }
+
+def save_result(output_dir: Path, model_name: str, image_id: str, result: Dict[str, Any]):
+    output_file = output_dir / model_name / f"{image_id}.json"
+    with span("write_result", image_id=image_id, model=model_name):
+        with open(output_file, 'w') as f:
+            json.dump(result, f, indent=2)
+
+@contextlib.contextmanager
+def file_lock(path: Path):
+    """Hold an exclusive advisory lock on `<path>.lock` for the duration of the block"""
+    lock_path = Path(f"{path}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_json_atomic(path: Path, data: Any):
+    """Write JSON through a temporary file so readers never see a partial file"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def load_summary(summary_file: Path) -> Dict[str, Any]:
+    if not summary_file.exists():
+        return {}
+    try:
+        with open(summary_file, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print("Warning: Existing benchmark summary is invalid, creating new one")
+        return {}
+
+def update_summary(summary_file: Path, updates: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Replace the entries for the given models in the summary, keeping all others"""
+    summary_file = Path(summary_file)
+    with file_lock(summary_file):
+        benchmark_results = load_summary(summary_file)
+        benchmark_results.update(updates)
+        write_json_atomic(summary_file, benchmark_results)
+    return benchmark_results
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse `i/N` (1-based) into (i, N)"""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard '{value}', expected i/N")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard '{value}', expected 1 <= i <= N")
+    return index, count
+
+def select_shard(image_ids: List[str], shard: Tuple[int, int]) -> List[str]:
+    """Round-robin split of the image list, so shards stay balanced"""
+    index, count = shard
+    return image_ids[index - 1::count]
+
+def shard_file(output_dir: Path, shard: Tuple[int, int]) -> Path:
+    index, count = shard
+    return Path(output_dir) / SHARD_DIR / f"{index}of{count}.json"
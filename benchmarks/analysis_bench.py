@@ -0,0 +1,231 @@
+"""Scaling benchmark for the analysis pipeline.
+
+Usage:
+    python benchmarks/analysis_bench.py [--scales 1,10,100] [--models 5] [--list-factor 1]
+                                        [--depth 0] [--seed 0] [--repeat 3] [--no-profile]
+                                        [--baseline FILE] [--tolerance 0.5] [--save-baseline]
+
+Synthesizes corpora from the real ground truth in ground_truth/output:
+`--scales` multiplies the number of images, `--models` sets the number of
+synthetic model result sets, `--list-factor` multiplies list lengths and
+`--depth` wraps every leaf value in extra levels of nesting. Each option
+takes a comma separated list and every combination is run as a case.
+
+Each case runs generate_summary() in a fresh subprocess and records wall
+time (best of `--repeat` runs), peak RSS and per-function profile times for analysis_script. Results
+are written to benchmarks/results/analysis_bench.json; when a baseline is
+present, cases slower than baseline * (1 + tolerance) fail the run.
+The 1000x scale (13000 images) is not run by default; pass it explicitly.
+"""
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import itertools
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+GROUND_TRUTH_DIR = REPO_ROOT / "ground_truth" / "output"
+RESULTS_DIR = REPO_ROOT / "benchmarks" / "results"
+RESULTS_FILE = RESULTS_DIR / "analysis_bench.json"
+BASELINE_FILE = RESULTS_DIR / "analysis_baseline.json"
+
+# Functions reported from the cProfile run of each case
+PROFILED_FUNCTIONS = [
+    "generate_summary", "analyze_images", "are_values_equal", "normalize_value",
+    "normalize_string", "flatten_dict", "get_field_value"
+]
+
+# Wall time differences below this are treated as noise when checking the baseline
+MIN_REGRESSION_SECONDS = 0.05
+
+MISSING_RATE = 0.1
+ERROR_RATE = 0.15
+
+def parse_list(args: List[str], flag: str, default: str, cast=int) -> List:
+    value = args[args.index(flag) + 1] if flag in args else default
+    return [cast(v) for v in value.split(',')]
+
+def scale_lists(value: Any, factor: int) -> Any:
+    """Repeat list items so every list is `factor` times longer"""
+    if isinstance(value, dict):
+        return {k: scale_lists(v, factor) for k, v in value.items()}
+    if isinstance(value, list) and factor > 1:
+        return [f"{item} ({i})" if isinstance(item, str) else item
+                for i in range(factor) for item in value]
+    return value
+
+def deepen(value: Any, depth: int) -> Any:
+    """Wrap every leaf value in `depth` extra levels of nesting"""
+    if isinstance(value, dict):
+        return {k: deepen(v, depth) for k, v in value.items()}
+    for level in range(depth):
+        value = {f"level{level}": value}
+    return value
+
+def perturb(value: Any, rng: random.Random) -> Any:
+    """Simulate a model output: drop some fields and mistranscribe some strings"""
+    if isinstance(value, dict):
+        return {k: perturb(v, rng) for k, v in value.items() if rng.random() >= MISSING_RATE}
+    if isinstance(value, list):
+        return [perturb(item, rng) for item in value]
+    if isinstance(value, str) and rng.random() < ERROR_RATE:
+        return value[::-1]
+    return value
+
+def synthesize_corpus(root: Path, scale: int, models: int, list_factor: int, depth: int, seed: int) -> List[str]:
+    """Write a synthetic ground truth and benchmark_data tree, returning the model names"""
+    rng = random.Random(seed)
+    gt_dir = root / "ground_truth"
+    bench_dir = root / "benchmark_data"
+    gt_dir.mkdir(parents=True)
+    model_names = [f"model-{i}" for i in range(models)]
+    for model in model_names:
+        (bench_dir / model).mkdir(parents=True)
+
+    sources = sorted(GROUND_TRUTH_DIR.glob('*.json'))
+    for copy in range(scale):
+        for source in sources:
+            image_id = f"{source.stem}-{copy}"
+            with open(source) as f:
+                ground_truth = deepen(scale_lists(json.load(f), list_factor), depth)
+            with open(gt_dir / f"{image_id}.json", 'w') as f:
+                json.dump(ground_truth, f)
+            for model in model_names:
+                with open(bench_dir / model / f"{image_id}.json", 'w') as f:
+                    json.dump({"annotations": perturb(ground_truth, rng)}, f)
+
+    summary = {
+        model: {
+            "total_cost": 1.0, "total_time": 100, "total_tokens": 1000,
+            "processed_images": scale * len(sources),
+            "average_cost_per_image": 0.01, "average_time_per_image": 10.0,
+            "failed_images": []
+        }
+        for model in model_names
+    }
+    with open(bench_dir / "benchmark_summary.json", 'w') as f:
+        json.dump(summary, f)
+    return model_names
+
+def peak_rss_mb() -> float:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_case(root: str, models: List[str], repeat: int, profile: bool) -> Dict[str, Any]:
+    """Run in the child process: time generate_summary and profile it"""
+    import io
+    import cProfile
+    import pstats
+    import contextlib
+    sys.path.insert(0, str(REPO_ROOT))
+    import analysis_script
+
+    gt_dir, bench_dir = f"{root}/ground_truth", f"{root}/benchmark_data"
+    result = {"baseline_rss_mb": peak_rss_mb()}
+
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            summary = analysis_script.generate_summary(gt_dir, bench_dir, models)
+            timings.append(time.perf_counter() - start)
+    result["wall_time"] = round(min(timings), 4)
+    result["peak_rss_mb"] = peak_rss_mb()
+    result["fields"] = sum(len(a["fields"]) for a in summary["analyses"].values())
+
+    if profile:
+        profiler = cProfile.Profile()
+        with contextlib.redirect_stdout(io.StringIO()):
+            profiler.runcall(analysis_script.generate_summary, gt_dir, bench_dir, models)
+        stats = pstats.Stats(profiler).stats
+        functions = {}
+        for (filename, _, name), (_, calls, tottime, cumtime, _) in stats.items():
+            if filename.endswith("analysis_script.py") and name in PROFILED_FUNCTIONS:
+                functions[name] = {"calls": calls, "tottime": round(tottime, 4), "cumtime": round(cumtime, 4)}
+        result["functions"] = functions
+    return result
+
+def case_key(case: Dict[str, int]) -> str:
+    return f"x{case['scale']}-m{case['models']}-l{case['list_factor']}-d{case['depth']}"
+
+def main():
+    args = sys.argv[1:]
+
+    if "--run-case" in args:
+        spec = json.loads(args[args.index("--run-case") + 1])
+        print(json.dumps(run_case(spec["root"], spec["models"], spec["repeat"], spec["profile"])))
+        return
+
+    profile = "--no-profile" not in args
+    seed = int(args[args.index("--seed") + 1]) if "--seed" in args else 0
+    repeat = int(args[args.index("--repeat") + 1]) if "--repeat" in args else 3
+    tolerance = float(args[args.index("--tolerance") + 1]) if "--tolerance" in args else 0.5
+    baseline_file = Path(args[args.index("--baseline") + 1]) if "--baseline" in args else BASELINE_FILE
+
+    grid = itertools.product(
+        parse_list(args, "--scales", "1,10,100"),
+        parse_list(args, "--models", "5"),
+        parse_list(args, "--list-factor", "1"),
+        parse_list(args, "--depth", "0")
+    )
+
+    cases = []
+    for scale, models, list_factor, depth in grid:
+        case = {"scale": scale, "models": models, "list_factor": list_factor, "depth": depth}
+        root = Path(tempfile.mkdtemp(prefix="analysis_bench_"))
+        try:
+            model_names = synthesize_corpus(root, scale, models, list_factor, depth, seed)
+            spec = json.dumps({"root": str(root), "models": model_names, "repeat": repeat, "profile": profile})
+            child = subprocess.run(
+                [sys.executable, __file__, "--run-case", spec],
+                capture_output=True, text=True, check=True
+            )
+        finally:
+            shutil.rmtree(root)
+        case.update(json.loads(child.stdout.strip().splitlines()[-1]))
+        case["key"] = case_key(case)
+        cases.append(case)
+        print(f"{case['key']:<20} {case['fields']:>9} fields {case['wall_time']:>9.3f}s {case['peak_rss_mb']:>8.1f} MB")
+
+    results = {
+        "python": sys.version.split()[0],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": seed,
+        "cases": cases
+    }
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {RESULTS_FILE.relative_to(REPO_ROOT)}")
+
+    if "--save-baseline" in args:
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline_file}")
+        return
+
+    if baseline_file.exists():
+        with open(baseline_file) as f:
+            baseline = {case["key"]: case for case in json.load(f)["cases"]}
+        regressions = []
+        for case in cases:
+            before = baseline.get(case["key"])
+            if before and case["wall_time"] > before["wall_time"] * (1 + tolerance) \
+                    and case["wall_time"] - before["wall_time"] > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{case['key']}: {before['wall_time']:.3f}s -> {case['wall_time']:.3f}s")
+        if regressions:
+            print("Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
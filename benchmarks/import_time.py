@@ -0,0 +1,90 @@
+"""Track CLI startup cost with `python -X importtime`.
+
+Usage:
+    python benchmarks/import_time.py [--runs N] [--max-ms MS]
+
+Measures the cumulative import time of the project entry points (and, for
+reference, each provider SDK on its own) and stores the medians in
+benchmarks/results/import_time.json so changes can be compared run to run.
+"""
+import sys
+import json
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_FILE = REPO_ROOT / "benchmarks" / "results" / "import_time.json"
+
+# Modules the CLI and subprocess callers (server.js, produce_ground_truth.py) load
+ENTRY_POINTS = ["models_config", "process_images", "analysis_script"]
+
+# Provider SDKs, measured separately so their cost is visible in the report
+PROVIDER_SDKS = ["openai", "anthropic", "google.generativeai", "httpx"]
+
+def measure_import(module: str) -> Optional[int]:
+    """Return the cumulative import time of a module in microseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        return None
+
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    for line in reversed(result.stderr.splitlines()):
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    return None
+
+def measure_modules(modules: List[str], runs: int) -> Dict[str, Optional[float]]:
+    """Return the median cumulative import time in milliseconds for each module"""
+    medians = {}
+    for module in modules:
+        samples = [measure_import(module) for _ in range(runs)]
+        samples = [s for s in samples if s is not None]
+        medians[module] = round(statistics.median(samples) / 1000, 2) if samples else None
+    return medians
+
+def main():
+    args = sys.argv[1:]
+    runs = int(args[args.index("--runs") + 1]) if "--runs" in args else 5
+    max_ms = float(args[args.index("--max-ms") + 1]) if "--max-ms" in args else None
+
+    previous = {}
+    if RESULTS_FILE.exists():
+        with open(RESULTS_FILE) as f:
+            previous = json.load(f)
+
+    results = {
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "entry_points_ms": measure_modules(ENTRY_POINTS, runs),
+        "provider_sdks_ms": measure_modules(PROVIDER_SDKS, runs)
+    }
+
+    print(f"{'module':<24} {'median ms':>10} {'previous':>10}")
+    for section in ("entry_points_ms", "provider_sdks_ms"):
+        for module, value in results[section].items():
+            before = previous.get(section, {}).get(module)
+            shown = "not installed" if value is None else f"{value:.2f}"
+            shown_before = "-" if before is None else f"{before:.2f}"
+            print(f"{module:<24} {shown:>10} {shown_before:>10}")
+
+    RESULTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {RESULTS_FILE.relative_to(REPO_ROOT)}")
+
+    if max_ms is not None:
+        slow = {m: v for m, v in results["entry_points_ms"].items() if v is not None and v > max_ms}
+        if slow:
+            print(f"Entry points over {max_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Cost-aware model cascade for process_images.py.
+
+Each image is first annotated by a cheap model (optionally alongside a
+second cheap "check" model, run concurrently). The image is escalated to
+a stronger model when the cheap output failed to parse, is sparse, or
+disagrees with the check model. Stage results are written to
+benchmark_data/cascade/<model>/ and the final answers to
+benchmark_data/cascade/cascade/, so they can be scored by analysis_script
+against each single model's full run in benchmark_data. Every model is
+scored on its own, since analyze_images() credits a model for omitting
+fields that only other analyzed models invented.
+
+The stage processors (process_images.ImageProcessor) are passed in by
+process_images.py, so this module does not import it back.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from analysis_script import analyze_images, are_values_equal, flatten_dict, get_field_value, model_rates
+from benchmark_store import BenchmarkStats, load_summary, save_result, update_summary
+from planner import SpendGuard, budget_guard
+from providers import ImageRequest
+from tolerant_json import PARSE_FAILED
+
+CASCADE_MODEL = "cascade"
+
+@dataclass
+class CascadeConfig:
+    cheap: str
+    strong: str
+    check: Optional[str] = None
+    # Escalate when the cheap output has fewer leaf fields than this
+    min_fields: int = 5
+    # Escalate when cheap and check agree on less than this fraction of fields
+    min_agreement: float = 0.6
+
+    def stages(self) -> List[str]:
+        return [self.cheap, self.strong] + ([self.check] if self.check else [])
+
+class CascadeStageError(Exception):
+    """A stage failed after earlier stages were paid for; carries their results"""
+
+    def __init__(self, message: str, stage_results: Dict[str, Dict[str, Any]]):
+        super().__init__(message)
+        self.stage_results = stage_results
+
+def field_agreement(a: Any, b: Any) -> float:
+    """Fraction of the union of field paths on which two annotations agree"""
+    paths = set(flatten_dict(a)) | set(flatten_dict(b))
+    if not paths:
+        return 1.0
+    agreed = sum(are_values_equal(get_field_value(a, path)[0], get_field_value(b, path)[0]) for path in paths)
+    return agreed / len(paths)
+
+class CascadeProcessor:
+    def __init__(self, cascade: CascadeConfig, processors: Dict[str, Any]):
+        """`processors` maps each stage model to an ImageProcessor"""
+        self.cascade = cascade
+        self.processors = {name: processors[name] for name in cascade.stages()}
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cascade")
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+    def _escalation_reason(self, cheap: Dict[str, Any], check: Optional[Dict[str, Any]]) -> Optional[str]:
+        if cheap.get('parse_status') == PARSE_FAILED:
+            return "parse_failure"
+        if len(flatten_dict(cheap['annotations'])) < self.cascade.min_fields:
+            return "sparse"
+        if check is not None and field_agreement(cheap['annotations'], check['annotations']) < self.cascade.min_agreement:
+            return "disagreement"
+        return None
+
+    def process_request(self, images: ImageRequest) -> Dict[str, Any]:
+        start_time = time.time()
+        cascade = self.cascade
+        stage_results: Dict[str, Dict[str, Any]] = {}
+
+        futures = {cascade.cheap: self.pool.submit(self.processors[cascade.cheap].process_request, images)}
+        if cascade.check:
+            futures[cascade.check] = self.pool.submit(self.processors[cascade.check].process_request, images)
+        errors = {}
+        for name, future in futures.items():
+            try:
+                stage_results[name] = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+
+        cheap = stage_results.get(cascade.cheap)
+        check = stage_results.get(cascade.check) if cascade.check else None
+        if cheap is None:
+            reason = "error"
+        elif cascade.check and check is None:
+            # Without the check model only the cheap output's own signals are available
+            reason = self._escalation_reason(cheap, None)
+        else:
+            reason = self._escalation_reason(cheap, check)
+
+        if reason:
+            try:
+                stage_results[cascade.strong] = self.processors[cascade.strong].process_request(images)
+            except Exception as e:
+                raise CascadeStageError(f"{cascade.strong} failed after escalation ({reason}): {str(e)}",
+                                        stage_results) from e
+        final = stage_results[cascade.strong if reason else cascade.cheap]
+
+        return {
+            "photo_id": images.photo_id,
+            "model": CASCADE_MODEL,
+            "annotations": final['annotations'],
+            "input_tokens": sum(r['input_tokens'] for r in stage_results.values()),
+            "output_tokens": sum(r['output_tokens'] for r in stage_results.values()),
+            "total_tokens": sum(r['total_tokens'] for r in stage_results.values()),
+            "cost": sum(r['cost'] for r in stage_results.values()),
+            "status": "OK",
+            "parse_status": final.get('parse_status'),
+            "request_time": round(time.time() - start_time),
+            "cascade": {
+                "escalated": reason is not None,
+                "reason": reason,
+                "answered_by": cascade.strong if reason else cascade.cheap,
+                "stage_errors": errors,
+                "stages": {name: result for name, result in stage_results.items()}
+            }
+        }
+
+def run_cascade(image_ids: List[str], cascade: CascadeConfig, processors: Dict[str, Any],
+                output_dir: str = "benchmark_data/cascade", budget: float = None) -> Dict[str, Any]:
+    """Run the cascade over `image_ids` with an ImageProcessor per stage model.
+
+    With a budget, the run is refused if the cheap stages alone are projected
+    to exceed it, and each image is only started if an escalation would
+    still fit.
+    """
+    guard = None
+    if budget is not None:
+        stages = {name: processors[name].config for name in cascade.stages()}
+        guard = budget_guard(budget, stages, len(image_ids), projected_models=[cascade.cheap, cascade.check])
+
+    output_dir = Path(output_dir)
+    (output_dir / CASCADE_MODEL).mkdir(parents=True, exist_ok=True)
+    for name in cascade.stages():
+        (output_dir / name).mkdir(exist_ok=True)
+    processor = CascadeProcessor(cascade, processors)
+    try:
+        stats, escalations, elapsed = _run_images(processor, image_ids, output_dir, guard)
+    finally:
+        processor.shutdown()
+
+    summary = stats.get_summary()
+    summary["escalations"] = escalations
+    summary["images_per_second"] = round(stats.processed_images / max(elapsed, 1e-9), 4)
+    update_summary(output_dir / "benchmark_summary.json", {CASCADE_MODEL: summary})
+    return summary
+
+def _run_images(processor: CascadeProcessor, image_ids: List[str], output_dir: Path,
+                guard: Optional[SpendGuard]) -> Tuple[BenchmarkStats, Dict[str, int], float]:
+    cascade = processor.cascade
+    stats = BenchmarkStats()
+    escalations: Dict[str, int] = {}
+    start_time = time.time()
+    for image_id in image_ids:
+        reserved = guard.reserve(list(processor.processors)) if guard else 0.0
+        if reserved is None:
+            print(f"\nStopped early: the next image could exceed the ${guard.budget:.4f} budget (spent ${guard.spent:.4f})")
+            break
+        cost = 0.0
+        try:
+            print(f"Processing {image_id} with cascade {cascade.cheap} -> {cascade.strong}...")
+            result = processor.process_request(ImageRequest(image_id))
+            for name, stage in result["cascade"].pop("stages").items():
+                save_result(output_dir, name, image_id, stage)
+            save_result(output_dir, CASCADE_MODEL, image_id, result)
+            stats.update(result)
+            cost = result['cost']
+            reason = result["cascade"]["reason"]
+            if reason:
+                escalations[reason] = escalations.get(reason, 0) + 1
+            print(f"Answered by {result['cascade']['answered_by']}" + (f" ({reason})" if reason else ""))
+        except CascadeStageError as e:
+            # Keep the stages that were paid for, and count their cost
+            for name, stage in e.stage_results.items():
+                save_result(output_dir, name, image_id, stage)
+            print(f"Failed to process {image_id} with cascade: {str(e)}")
+            cost = sum(stage['cost'] for stage in e.stage_results.values())
+            stats.add_failure(image_id, e, cost=cost,
+                              tokens=sum(stage['total_tokens'] for stage in e.stage_results.values()))
+        except Exception as e:
+            print(f"Failed to process {image_id} with cascade: {str(e)}")
+            stats.add_failure(image_id, e)
+        if guard:
+            guard.settle(reserved, cost)
+    return stats, escalations, time.time() - start_time
+
+def _accuracy(benchmark_dir: str, model: str) -> Optional[float]:
+    return model_rates(analyze_images(benchmark_dir=benchmark_dir, models=[model]), model).get("accuracy")
+
+def compare_cascade(cascade: CascadeConfig, cascade_summary: Dict[str, Any],
+                    cascade_dir: str = "benchmark_data/cascade", benchmark_dir: str = "benchmark_data",
+                    replay: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Accuracy, cost and latency of the cascade next to each single model's full run.
+
+    Latency is the average per-image request time for every row. A replayed
+    cascade's latency is synthetic, so it is left out.
+    """
+    singles = [name for name in (cascade.cheap, cascade.check, cascade.strong) if name]
+    benchmark_summary = load_summary(Path(benchmark_dir) / "benchmark_summary.json")
+
+    report = {}
+    for name in singles:
+        runs = benchmark_summary.get(name, {})
+        report[name] = {
+            "accuracy": _accuracy(benchmark_dir, name),
+            "cost_per_image": runs.get("average_cost_per_image"),
+            "time_per_image": runs.get("average_time_per_image")
+        }
+    report[CASCADE_MODEL] = {
+        "accuracy": _accuracy(cascade_dir, CASCADE_MODEL),
+        "cost_per_image": cascade_summary["average_cost_per_image"],
+        "time_per_image": None if replay else cascade_summary["average_time_per_image"]
+    }
+    return report
+
+def print_report(report: Dict[str, Dict[str, Any]]):
+    print(f"\n{'model':<30} {'accuracy':>9} {'cost/image':>11} {'s/image':>8}")
+    for name, row in report.items():
+        accuracy = "-" if row["accuracy"] is None else f"{row['accuracy']:.1%}"
+        cost = "-" if row["cost_per_image"] is None else f"${row['cost_per_image']:.4f}"
+        latency = "-" if row["time_per_image"] is None else f"{row['time_per_image']:.2f}"
+        print(f"{name:<30} {accuracy:>9} {cost:>11} {latency:>8}")
+    print("(single-model rows come from the full runs in benchmark_data; each model is scored on its own)")
@@ -0,0 +1,178 @@
+"""Columnar status matrix over analysis results, with vectorized breakdowns.
+
+analyze_images() produces nested FieldAnalysis objects; this module flattens
+the statuses that count towards the metrics into parallel NumPy columns
+(image, field path, model, status), one row per scored field per model.
+List items are scored individually but grouped under their list's path.
+Aggregations per field path, section (artwork/photograph/
+additional_annotations) or side (front/back) are then a single bincount.
+
+Usage:
+    python metrics_matrix.py [--by field_path|section|side] [--model MODEL] [--cache FILE.npz]
+
+A --cache file is rebuilt when the ground truth or model results it was built
+from have changed (by file name, size or modification time).
+"""
+import sys
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List
+import numpy as np
+
+STATUSES = ['correct', 'incorrect_transcription', 'missing']
+SIDES = ['front', 'back']
+
+class StatusMatrix:
+    def __init__(self, images: List[str], paths: List[str], models: List[str],
+                 image: np.ndarray, path: np.ndarray, model: np.ndarray, status: np.ndarray,
+                 fingerprint: str = ""):
+        self.images = images
+        self.paths = paths
+        self.models = models
+        self.image = image
+        self.path = path
+        self.model = model
+        self.status = status
+        # Identifies the source files the matrix was built from, see source_fingerprint()
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_analyses(cls, analyses: Dict[str, Any]) -> "StatusMatrix":
+        """Build from the ImageAnalysis objects returned by analyze_images()"""
+        path_index: Dict[str, int] = {}
+        model_index: Dict[str, int] = {}
+        status_index = {status: i for i, status in enumerate(STATUSES)}
+        images, image_col, path_col, model_col, status_col = [], [], [], [], []
+
+        for image_idx, analysis in enumerate(analyses.values()):
+            images.append(analysis.image_id)
+            # Whole-list rows are only for display; their items are what is scored
+            list_parents = {field.parent_path for field in analysis.fields if field.is_list_item}
+            for field in analysis.fields:
+                if not field.is_list_item and field.field_path in list_parents:
+                    continue
+                path_idx = path_index.setdefault(field.parent_path or field.field_path, len(path_index))
+                for model, status in field.status.items():
+                    if status not in status_index:
+                        continue
+                    image_col.append(image_idx)
+                    path_col.append(path_idx)
+                    model_col.append(model_index.setdefault(model, len(model_index)))
+                    status_col.append(status_index[status])
+
+        return cls(
+            images, list(path_index), list(model_index),
+            np.asarray(image_col, dtype=np.int32),
+            np.asarray(path_col, dtype=np.int32),
+            np.asarray(model_col, dtype=np.int16),
+            np.asarray(status_col, dtype=np.int8)
+        )
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path, images=np.array(self.images), paths=np.array(self.paths), models=np.array(self.models),
+            image=self.image, path=self.path, model=self.model, status=self.status,
+            fingerprint=np.array(self.fingerprint)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "StatusMatrix":
+        data = np.load(path)
+        return cls(
+            data['images'].tolist(), data['paths'].tolist(), data['models'].tolist(),
+            data['image'], data['path'], data['model'], data['status'],
+            str(data['fingerprint']) if 'fingerprint' in data else ""
+        )
+
+    def counts(self, path_groups: np.ndarray, group_count: int) -> np.ndarray:
+        """Status counts with shape (groups, models, statuses) for a path -> group mapping"""
+        shape = (group_count, len(self.models), len(STATUSES))
+        flat = np.ravel_multi_index((path_groups[self.path], self.model, self.status), shape)
+        return np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+
+    def by_field_path(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return self._table(np.arange(len(self.paths)), self.paths)
+
+    def by_section(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return self._group_by(lambda path: path.split('.')[0])
+
+    def by_side(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        # Sides appear as a path component, e.g. artwork.back.title or additional_annotations.front
+        return self._group_by(lambda path: next((part for part in path.split('.') if part in SIDES), 'none'))
+
+    def _group_by(self, key) -> Dict[str, Dict[str, Dict[str, float]]]:
+        group_names = sorted({key(path) for path in self.paths})
+        group_index = {name: i for i, name in enumerate(group_names)}
+        path_groups = np.array([group_index[key(path)] for path in self.paths], dtype=np.int32)
+        return self._table(path_groups, group_names)
+
+    def _table(self, path_groups: np.ndarray, group_names: List[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        counts = self.counts(path_groups, len(group_names))
+        totals = counts.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = counts / totals[..., None]
+
+        table = {}
+        for g, group in enumerate(group_names):
+            table[group] = {}
+            for m, model in enumerate(self.models):
+                if totals[g, m] == 0:
+                    continue
+                row = {"accuracy": float(rates[g, m, 0]), "total": int(totals[g, m])}
+                row.update({status: int(counts[g, m, s]) for s, status in enumerate(STATUSES)})
+                table[group][model] = row
+        return table
+
+def source_fingerprint(ground_truth_dir: str = 'ground_truth/output', benchmark_dir: str = 'benchmark_data',
+                       models: List[str] = None) -> str:
+    """Hash of the names, sizes and mtimes of the files analyze_images() reads"""
+    from models_config import MODEL_NAMES
+    files = sorted(Path(ground_truth_dir).glob('*.json'))
+    for model in MODEL_NAMES if models is None else models:
+        files.extend(sorted((Path(benchmark_dir) / model).glob('*.json')))
+    digest = hashlib.sha256()
+    for file in files:
+        stat = file.stat()
+        digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def breakdowns(analyses: Dict[str, Any]) -> Dict[str, Dict[str, Dict[str, Dict[str, float]]]]:
+    """Per-field-path, per-section and per-side accuracy tables"""
+    matrix = StatusMatrix.from_analyses(analyses)
+    return {
+        "field_path": matrix.by_field_path(),
+        "section": matrix.by_section(),
+        "side": matrix.by_side()
+    }
+
+def print_table(table: Dict[str, Dict[str, Dict[str, float]]], models: List[str]):
+    width = max([len(group) for group in table] + [10])
+    print(f"{'':<{width}} " + " ".join(f"{model[:14]:>14}" for model in models))
+    for group, rows in sorted(table.items()):
+        cells = [f"{rows[model]['accuracy']:>13.1%} " if model in rows else f"{'-':>14}" for model in models]
+        print(f"{group:<{width}} " + " ".join(cells))
+
+def main():
+    args = sys.argv[1:]
+    by = args[args.index("--by") + 1] if "--by" in args else "section"
+    model = args[args.index("--model") + 1] if "--model" in args else None
+    cache = args[args.index("--cache") + 1] if "--cache" in args else None
+    if by not in ("field_path", "section", "side"):
+        print("Usage: python metrics_matrix.py [--by field_path|section|side] [--model MODEL] [--cache FILE.npz]")
+        sys.exit(1)
+
+    fingerprint = source_fingerprint()
+    matrix = StatusMatrix.load(cache) if cache and Path(cache).exists() else None
+    if matrix is None or matrix.fingerprint != fingerprint:
+        from analysis_script import analyze_images
+        matrix = StatusMatrix.from_analyses(analyze_images())
+        matrix.fingerprint = fingerprint
+        if cache:
+            matrix.save(cache)
+
+    table = getattr(matrix, f"by_{by}")()
+    models = [model] if model else matrix.models
+    print_table(table, models)
+
+if __name__ == "__main__":
+    main()
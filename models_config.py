@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
 
 @dataclass
 class ProcessingConfig:
@@ -7,6 +7,11 @@ class ProcessingConfig:
     model: str
     input_cost_per_million: float
     output_cost_per_million: float
+    # Adapter-specific settings, e.g. latency/error rates for the replay adapter
+    options: Dict[str, Any] = field(default_factory=dict)
+    # Provider rate limits for the account, used by `process_images.py plan` (None = unknown)
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
 
 MODEL_CONFIGS = {
     'gpt-4o': ProcessingConfig(
@@ -49,3 +54,11 @@ MODEL_CONFIGS = {
 
 # Export model names as a list for easy access
 MODEL_NAMES: List[str] = list(MODEL_CONFIGS.keys())
+
+def replay_config(model_name: str, **options) -> ProcessingConfig:
+    """Config replaying recorded results of a model with its pricing"""
+    return replace(
+        MODEL_CONFIGS[model_name],
+        api_type='replay',
+        options={'source_model': model_name, **options}
+    )
@@ -0,0 +1,185 @@
+"""Pre-flight cost and wall-time estimates from historical runs, and spend limits.
+
+Per-model distributions of input/output tokens and request latency are read
+from the existing results in benchmark_data/<model>/ and priced with the
+model's ProcessingConfig. Models without history fall back to the pooled
+history of all models.
+"""
+import json
+import math
+import statistics
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from models_config import ProcessingConfig
+
+@dataclass
+class ModelHistory:
+    input_tokens: List[int] = field(default_factory=list)
+    output_tokens: List[int] = field(default_factory=list)
+    request_times: List[float] = field(default_factory=list)
+
+    def extend(self, other: "ModelHistory"):
+        self.input_tokens.extend(other.input_tokens)
+        self.output_tokens.extend(other.output_tokens)
+        self.request_times.extend(other.request_times)
+
+def load_history(model: str, benchmark_dir: str = "benchmark_data") -> ModelHistory:
+    history = ModelHistory()
+    for result_file in sorted((Path(benchmark_dir) / model).glob('*.json')):
+        try:
+            with open(result_file) as f:
+                result = json.load(f)
+            history.input_tokens.append(result['input_tokens'])
+            history.output_tokens.append(result['output_tokens'])
+            history.request_times.append(result['request_time'])
+        except (json.JSONDecodeError, KeyError):
+            continue
+    return history
+
+# One-sided z-score of the 90th percentile of a normal distribution
+Z_P90 = 1.2816
+
+def _p90_total(expected: float, variance: float) -> float:
+    """p90 of a run's total cost, treating it as a sum of independent per-image costs (normal approximation)"""
+    return expected + Z_P90 * math.sqrt(variance)
+
+def estimate_model(config: ProcessingConfig, history: ModelHistory, image_count: int,
+                   concurrency: int = 1, pooled: bool = False) -> Dict[str, Any]:
+    """Projected cost, wall time and request/token rates for one model"""
+    costs = [
+        (i / 1_000_000) * config.input_cost_per_million + (o / 1_000_000) * config.output_cost_per_million
+        for i, o in zip(history.input_tokens, history.output_tokens)
+    ]
+    tokens = [i + o for i, o in zip(history.input_tokens, history.output_tokens)]
+    # Recorded request times are whole seconds, so never assume less than one
+    latency = max(1.0, statistics.mean(history.request_times))
+    cost_per_image = statistics.mean(costs)
+    # Variance of the sum of image_count independent per-image costs
+    cost_variance = (statistics.variance(costs) if len(costs) > 1 else 0.0) * image_count
+    waves = math.ceil(image_count / max(1, concurrency))
+    requests_per_minute = 60 * min(concurrency, image_count) / latency
+    tokens_per_minute = requests_per_minute * statistics.mean(tokens)
+
+    estimate = {
+        "history_samples": len(costs),
+        "history_from_other_models": pooled,
+        "images": image_count,
+        # Unrounded beyond micro-dollars: spend guards reserve it per request
+        "cost_per_image": round(cost_per_image, 6),
+        "expected_cost": round(cost_per_image * image_count, 4),
+        "cost_variance": cost_variance,
+        "p90_cost": round(_p90_total(cost_per_image * image_count, cost_variance), 4),
+        "expected_wall_time": round(waves * latency, 1),
+        "requests_per_minute": round(requests_per_minute, 1),
+        "tokens_per_minute": round(tokens_per_minute),
+    }
+    for key, limit in (("requests_per_minute", config.requests_per_minute),
+                       ("tokens_per_minute", config.tokens_per_minute)):
+        # Fraction of the provider limit left unused at this concurrency (negative: throttling expected)
+        estimate[f"{key}_headroom"] = round(1 - estimate[key] / limit, 3) if limit else None
+    return estimate
+
+def plan_run(model_configs: Dict[str, ProcessingConfig], image_count: int, concurrency: int = 1,
+             benchmark_dir: str = "benchmark_data") -> Dict[str, Any]:
+    histories = {model: load_history(model, benchmark_dir) for model in model_configs}
+    pooled = ModelHistory()
+    for history in histories.values():
+        pooled.extend(history)
+
+    models = {}
+    for model, config in model_configs.items():
+        history = histories[model]
+        use_pooled = not history.input_tokens
+        if use_pooled and not pooled.input_tokens:
+            raise ValueError(f"No historical results in {benchmark_dir} to estimate from")
+        models[model] = estimate_model(config, pooled if use_pooled else history, image_count, concurrency, use_pooled)
+
+    return {
+        "images": image_count,
+        "concurrency": concurrency,
+        "models": models,
+        "expected_cost": round(sum(m["expected_cost"] for m in models.values()), 4),
+        # Models' costs are independent, so their variances add
+        "p90_cost": round(_p90_total(sum(m["expected_cost"] for m in models.values()),
+                                     sum(m["cost_variance"] for m in models.values())), 4),
+        # Models run one after another (model-major) or side by side (image-major)
+        "expected_wall_time_model_major": round(sum(m["expected_wall_time"] for m in models.values()), 1),
+        "expected_wall_time_image_major": max((m["expected_wall_time"] for m in models.values()), default=0)
+    }
+
+def print_plan(plan: Dict[str, Any]):
+    print(f"{'model':<30} {'$/image':>8} {'expected $':>11} {'p90 $':>9} {'wall s':>8} {'rpm':>7} {'tpm':>9} {'headroom':>9}")
+    for model, row in plan["models"].items():
+        headroom = [h for h in (row["requests_per_minute_headroom"], row["tokens_per_minute_headroom"]) if h is not None]
+        headroom_text = f"{min(headroom):.0%}" if headroom else "n/a"
+        name = model + (" *" if row["history_from_other_models"] else "")
+        print(f"{name:<30} {row['cost_per_image']:>8.4f} {row['expected_cost']:>11.4f} {row['p90_cost']:>9.4f} "
+              f"{row['expected_wall_time']:>8.0f} {row['requests_per_minute']:>7.1f} {row['tokens_per_minute']:>9} {headroom_text:>9}")
+    print(f"\nTotal for {plan['images']} images at concurrency {plan['concurrency']}: "
+          f"${plan['expected_cost']:.4f} expected, ${plan['p90_cost']:.4f} p90")
+    print(f"Wall time: {plan['expected_wall_time_model_major']:.0f}s model-major, "
+          f"{plan['expected_wall_time_image_major']:.0f}s image-major")
+    if any(row["history_from_other_models"] for row in plan["models"].values()):
+        print("* no history for this model; estimated from all models' results")
+
+class BudgetExceeded(Exception):
+    pass
+
+class SpendGuard:
+    """Hard budget for a run: a request is only started if its projected cost still fits.
+
+    Projected costs of requests in flight are reserved until their actual cost
+    is known, so concurrent requests cannot jointly overshoot the budget.
+    """
+
+    def __init__(self, budget: float, cost_per_request: Dict[str, float] = None):
+        self.budget = budget
+        # Projected cost of one request per model (or per processor name)
+        self.cost_per_request = cost_per_request or {}
+        self.spent = 0.0
+        self.reserved = 0.0
+        self.stopped = False
+
+    def reserve(self, names: List[str]) -> Optional[float]:
+        """Reserve the projected cost of one request to each of `names`, or None if it would exceed the budget"""
+        projected = sum(self.cost_per_request.get(name, 0.0) for name in names)
+        if self.spent + self.reserved + projected > self.budget:
+            self.stopped = True
+            return None
+        self.reserved += projected
+        return projected
+
+    def settle(self, reserved: float, cost: float):
+        self.reserved -= reserved
+        self.spent += cost
+
+    def check_projection(self, projected_cost: float):
+        if projected_cost > self.budget:
+            raise BudgetExceeded(f"Projected cost ${projected_cost:.4f} exceeds budget ${self.budget:.4f}")
+
+def budget_guard(budget: float, model_configs: Dict[str, ProcessingConfig], image_count: int,
+                 projected_models: List[str] = None, request_models: Dict[str, str] = None,
+                 benchmark_dir: str = "benchmark_data") -> SpendGuard:
+    """Spend guard priced from the plan; raises BudgetExceeded if the run is projected to exceed the budget.
+
+    Only `projected_models` (default: all) count towards the up-front
+    projection, for runs where some models are called conditionally.
+    `request_models` maps request names that differ from model names, such
+    as prompt matrix cells, to the model whose price they use.
+    """
+    try:
+        plan = plan_run(model_configs, image_count, benchmark_dir=benchmark_dir)
+    except ValueError as e:
+        print(f"Warning: cannot project cost ({str(e)}); enforcing the budget on actual spend only")
+        return SpendGuard(budget)
+
+    cost_per_image = {model: row["cost_per_image"] for model, row in plan["models"].items()}
+    if request_models is not None:
+        cost_per_image = {name: cost_per_image[model] for name, model in request_models.items()}
+    guard = SpendGuard(budget, cost_per_image)
+    projected = sum(row["expected_cost"] for model, row in plan["models"].items()
+                    if projected_models is None or model in projected_models)
+    guard.check_projection(projected)
+    print(f"Projected cost ${projected:.4f} is within the ${budget:.4f} budget")
+    return guard
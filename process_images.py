@@ -1,105 +1,49 @@
+import os
 import sys
 import json
 import time
-import base64
-import httpx
+import shutil
+import hashlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import Dict, Any, List
-import io
-from concurrent.futures import ThreadPoolExecutor
-from anthropic import Anthropic
-from openai import OpenAI
-import google.generativeai as genai
-from PIL import Image
-from models_config import ProcessingConfig, MODEL_CONFIGS
-
-class BenchmarkStats:
-    def __init__(self):
-        self.total_cost = 0.0
-        self.total_time = 0
-        self.total_tokens = 0
-        self.processed_images = 0
-        self.failed_images = []
-
-    def update(self, result: Dict[str, Any]):
-        self.total_cost += result['cost']
-        self.total_time += result['request_time']
-        self.total_tokens += result['total_tokens']
-        self.processed_images += 1
-
-    def add_failure(self, image_id: str, error: str):
-        self.failed_images.append({"image_id": image_id, "error": str(error)})
-
-    def get_summary(self) -> Dict[str, Any]:
-        return {
-            "total_cost": round(self.total_cost, 4),
-            "total_time": self.total_time,
-            "total_tokens": self.total_tokens,
-            "processed_images": self.processed_images,
-            "average_cost_per_image": round(self.total_cost / max(1, self.processed_images), 4),
-            "average_time_per_image": round(self.total_time / max(1, self.processed_images), 2),
-            "failed_images": self.failed_images
-        }
+from typing import Dict, Any, List, Tuple
+from dataclasses import replace
+from models_config import ProcessingConfig, MODEL_CONFIGS, replay_config
+from benchmark_store import (BenchmarkStats, file_lock, load_summary, save_result, update_summary,
+                             write_json_atomic, parse_shard, select_shard, shard_file, SHARD_DIR)
+from providers import ImageRequest, ProviderResponse, get_adapter
+from tracing import enable_tracing, span
+from tolerant_json import parse_annotations
+from planner import BudgetExceeded, SpendGuard, budget_guard, plan_run, print_plan
 
 class ImageProcessor:
     def __init__(self, config: ProcessingConfig, prompt_file: str):
         self.config = config
         with open(prompt_file, "r") as f:
             self.prompt = f.read()
-        self._setup_client()
-        
-    def _setup_client(self):
-        if self.config.api_type == 'openai':
-            with open("key.secret", "r") as f:
-                api_key = f.read().strip()
-            self.client = OpenAI(api_key=api_key)
-        elif self.config.api_type == 'claude':
-            with open("claudekey.secret", "r") as f:
-                api_key = f.read().strip()
-            self.client = Anthropic(api_key=api_key)
-        elif self.config.api_type == 'gemini':
-            with open("geminikey.secret", "r") as f:
-                api_key = f.read().strip()
-            genai.configure(api_key=api_key)
-            # Safety settings can be adjusted if needed
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            self.client = genai.GenerativeModel(
-                self.config.model,
-                safety_settings=safety_settings
-            )
-        else:
-            raise ValueError(f"Unsupported api_type: {self.config.api_type}")
-
-    def _get_base64_image(self, url: str) -> str:
-        response = httpx.get(url)
-        return base64.b64encode(response.content).decode("utf-8")
+        self.adapter = get_adapter(config)
 
     def process_images(self, image_id: str) -> Dict[str, Any]:
-        photo_id = image_id.split('!')[1]
-        base_url = "https://iiif.itatti.harvard.edu/iiif/2/digiteca!{}_{:d}.jpg/full/1024,1024/0/default.jpg"
-        image_url_1 = base_url.format(image_id, 1)
-        image_url_2 = base_url.format(image_id, 2)
+        return self.process_request(ImageRequest(image_id))
+
+    def process_request(self, images: ImageRequest) -> Dict[str, Any]:
+        with span("process_image", image_id=images.image_id, model=self.config.model):
+            return self._process_with_retry(images)
+
+    def _process_with_retry(self, images: ImageRequest) -> Dict[str, Any]:
+        prompt = self.prompt + "\n\nPlease provide the result in a JSON format."
 
         start_time = time.time()
         
         for attempt in range(2):
             try:
-                if self.config.api_type == 'openai':
-                    response = self._process_openai(image_url_1, image_url_2)
-                elif self.config.api_type == 'claude':
-                    response = self._process_claude(image_url_1, image_url_2)
-                elif self.config.api_type == 'gemini':
-                    response = self._process_gemini(image_url_1, image_url_2)
-                else:
-                    raise ValueError(f"Unknown api_type: {self.config.api_type}")
-
+                with span("attempt", image_id=images.image_id, model=self.config.model, attempt=attempt + 1):
+                    response = self.adapter.generate(prompt, images)
                 elapsed_time = round(time.time() - start_time)
-                return self._format_output(response, photo_id, elapsed_time)
+                with span("parse_output", image_id=images.image_id, model=self.config.model):
+                    return self._format_output(response, images.photo_id, elapsed_time)
             except Exception as e:
                 if attempt == 0:
                     print(f"Attempt {attempt + 1} failed, retrying...")
@@ -107,119 +51,18 @@ class ImageProcessor:
                 else:
                     raise
 
-    def _process_openai(self, url1: str, url2: str):
-        response_params = {
-            "model": self.config.model,
-            "messages": [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": self.prompt + "\n\nPlease provide the result in a JSON format."},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": url1,
-                        },
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": url2,
-                        },
-                    }
-                ]
-            }],
-            "response_format": {"type": "json_object"}
-        }
-        
-        return self.client.chat.completions.create(**response_params)
-
-    def _process_claude(self, url1: str, url2: str):
-        img1_data = self._get_base64_image(url1)
-        img2_data = self._get_base64_image(url2)
-        
-        return self.client.messages.create(
-            model=self.config.model,
-            max_tokens=8192,
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": self.prompt + "\n\nPlease provide the result in a JSON format."},
-                    {"type": "image", "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": img1_data
-                    }},
-                    {"type": "image", "source": {
-                        "type": "base64",
-                        "media_type": "image/jpeg",
-                        "data": img2_data
-                    }}
-                ]
-            }]
-        )
-
-    def _process_gemini(self, url1: str, url2: str):
-        # Fetch image bytes
-        img1_bytes = httpx.get(url1).content
-        img2_bytes = httpx.get(url2).content
-
-        # Prepare image parts for Gemini API
-        img1_part = {"mime_type": "image/jpeg", "data": img1_bytes}
-        img2_part = {"mime_type": "image/jpeg", "data": img2_bytes}
-
-        prompt_parts = [
-            self.prompt + "\n\nPlease provide the result in a JSON format.",
-            img1_part,
-            img2_part
-        ]
-
-        # Specify JSON output format
-        generation_config = genai.types.GenerationConfig(
-            response_mime_type="application/json"
-        )
-
-        return self.client.generate_content(
-            prompt_parts,
-            generation_config=generation_config
-        )
-
-    def _format_output(self, response, photo_id: str, request_time: int) -> Dict[str, Any]:
-        if self.config.api_type == 'openai':
-            input_tokens = response.usage.prompt_tokens
-            output_tokens = response.usage.completion_tokens
-            content = response.choices[0].message.content
-            total_tokens = input_tokens + output_tokens
-        elif self.config.api_type == 'claude':
-            input_tokens = response.usage.input_tokens
-            output_tokens = response.usage.output_tokens
-            content = response.content[0].text
-            total_tokens = input_tokens + output_tokens
-        elif self.config.api_type == 'gemini':
-            # Gemini token counts might be in usage_metadata
-            # Note: Gemini API might not always return token counts reliably for multimodal inputs yet.
-            # Using 0 as fallback if not present.
-            input_tokens = getattr(response.usage_metadata, 'prompt_token_count', 0)
-            output_tokens = getattr(response.usage_metadata, 'candidates_token_count', 0)
-            content = response.text
-            total_tokens = getattr(response.usage_metadata, 'total_token_count', input_tokens + output_tokens) # Use total if available
-        else:
-             raise ValueError(f"Unknown api_type for formatting: {self.config.api_type}")
+    def _format_output(self, response: ProviderResponse, photo_id: str, request_time: int) -> Dict[str, Any]:
+        input_tokens = response.input_tokens
+        output_tokens = response.output_tokens
+        total_tokens = response.total_tokens
+        content = response.content
 
         input_cost = (input_tokens / 1_000_000) * self.config.input_cost_per_million
         output_cost = (output_tokens / 1_000_000) * self.config.output_cost_per_million
 
-        # Handle markdown code blocks in Claude 3.7 output
-        if '```json' in content:
-            # Extract JSON from markdown code block
-            json_start = content.find('```json\n') + 8
-            json_end = content.rfind('```')
-            if json_end > json_start:
-                content = content[json_start:json_end].strip()
-
-        try:
-            annotations = json.loads(content)
-        except json.JSONDecodeError:
-            annotations = content
+        # Handles markdown code blocks (e.g. Claude 3.7), trailing text and truncated output;
+        # unparseable content is kept as the raw string
+        annotations, parse_status = parse_annotations(content)
 
         return {
             "photo_id": photo_id,
@@ -230,73 +73,344 @@ class ImageProcessor:
             "total_tokens": total_tokens,
             "cost": input_cost + output_cost,
             "status": "OK",
+            "parse_status": parse_status,
             "request_time": request_time
         }
 
-def run_benchmark(image_ids: List[str], prompt_file: str, models: List[str] = None):
-    output_dir = Path("benchmark_data")
-    output_dir.mkdir(exist_ok=True)
-    
-    # Create directories for each model
-    for model in MODEL_CONFIGS.keys():
-        model_dir = output_dir / model
-        model_dir.mkdir(exist_ok=True)
-    
-    # Filter models if specified
-    models_to_run = {k: v for k, v in MODEL_CONFIGS.items() if models is None or k in models}
-    
-    # Check if benchmark summary already exists
-    summary_file = output_dir / "benchmark_summary.json"
-    existing_benchmark_results = {}
-    if summary_file.exists():
-        try:
-            with open(summary_file, 'r') as f:
-                existing_benchmark_results = json.load(f)
-            print(f"Loaded existing benchmark summary with {len(existing_benchmark_results)} models")
-        except json.JSONDecodeError:
-            print("Warning: Existing benchmark summary is invalid, creating new one")
-    
-    # Process each model sequentially
-    benchmark_results = existing_benchmark_results.copy()
-    for model_name, config in models_to_run.items():
+def _run_model_major(processors: Dict[str, ImageProcessor], image_ids: List[str],
+                     output_dir: Path, guard: SpendGuard = None) -> Dict[str, BenchmarkStats]:
+    """Process each model sequentially, walking all images for each model"""
+    model_stats = {}
+    for model_name, processor in processors.items():
         print(f"\nProcessing with {model_name}...")
-        processor = ImageProcessor(config, prompt_file)
-        stats = BenchmarkStats()
+        stats = model_stats[model_name] = BenchmarkStats()
         
         for image_id in image_ids:
+            reserved = guard.reserve([model_name]) if guard else 0.0
+            if reserved is None:
+                return model_stats
+            cost = 0.0
             try:
                 print(f"Processing {image_id} with {model_name}...")
                 result = processor.process_images(image_id)
-                
-                # Save individual result
-                output_file = output_dir / model_name / f"{image_id}.json"
-                with open(output_file, 'w') as f:
-                    json.dump(result, f, indent=2)
-                
+                save_result(output_dir, model_name, image_id, result)
                 stats.update(result)
+                cost = result['cost']
                 print(f"Successfully processed {image_id}")
                 
             except Exception as e:
                 print(f"Failed to process {image_id} with {model_name}: {str(e)}")
                 stats.add_failure(image_id, e)
-        
-        # Save model statistics
-        benchmark_results[model_name] = stats.get_summary()
+            if guard:
+                guard.settle(reserved, cost)
+    return model_stats
+
+def _prefetch_pair(images: ImageRequest, needs_bytes: bool) -> ImageRequest:
+    if needs_bytes:
+        try:
+            images.prefetch()
+        except Exception as e:
+            # Nothing is cached for a failed download; adapters fetch again on demand and report per model
+            print(f"Prefetch of {images.image_id} failed: {str(e)}")
+    return images
+
+def _run_image_major(processors: Dict[str, ImageProcessor], image_ids: List[str],
+                     output_dir: Path, prefetch: int, guard: SpendGuard = None) -> Dict[str, BenchmarkStats]:
+    """Fetch each image pair once and send it to every model concurrently.
+
+    Up to `prefetch` pairs are downloaded ahead of the ones being processed,
+    and at most `prefetch + 1` pairs are in flight at the models; a pair's
+    bytes are released once every model has finished with it. A failed
+    prefetch caches nothing, so each model downloads the pair again. With a spend
+    guard, a pair is only sent if its projected cost, on top of the spend so
+    far and the pairs in flight, fits the budget.
+    """
+    if prefetch < 0:
+        raise ValueError(f"prefetch must be at least 0, got {prefetch}")
+    model_stats = {model_name: BenchmarkStats() for model_name in processors}
+    needs_bytes = any(processor.adapter.needs_image_bytes for processor in processors.values())
+    pending_ids = iter(image_ids)
+    fetches = deque()
+    in_flight = deque()
+
+    def collect(images: ImageRequest, futures: Dict[str, Future], reserved: float):
+        cost = 0.0
+        for model_name, future in futures.items():
+            try:
+                result = future.result()
+                save_result(output_dir, model_name, images.image_id, result)
+                model_stats[model_name].update(result)
+                cost += result['cost']
+                print(f"Successfully processed {images.image_id} with {model_name}")
+            except Exception as e:
+                print(f"Failed to process {images.image_id} with {model_name}: {str(e)}")
+                model_stats[model_name].add_failure(images.image_id, e)
+        images.release()
+        if guard:
+            guard.settle(reserved, cost)
+
+    with ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="prefetch") as fetch_pool, \
+         ThreadPoolExecutor(max_workers=len(processors) * (prefetch + 1), thread_name_prefix="model") as model_pool:
+        for image_id in islice(pending_ids, prefetch + 1):
+            fetches.append(fetch_pool.submit(_prefetch_pair, ImageRequest(image_id), needs_bytes))
+
+        while fetches:
+            images = fetches.popleft().result()
+            next_id = next(pending_ids, None)
+            if next_id is not None:
+                fetches.append(fetch_pool.submit(_prefetch_pair, ImageRequest(next_id), needs_bytes))
+
+            # Bound the number of pairs held in memory while models are busy
+            while len(in_flight) > prefetch:
+                collect(*in_flight.popleft())
+            reserved = guard.reserve(list(processors)) if guard else 0.0
+            if reserved is None:
+                images.release()
+                break
+
+            print(f"Processing {images.image_id} with {', '.join(processors)}...")
+            futures = {model_name: model_pool.submit(processor.process_request, images)
+                       for model_name, processor in processors.items()}
+            in_flight.append((images, futures, reserved))
+
+        while in_flight:
+            collect(*in_flight.popleft())
+    return model_stats
+
+def run_benchmark(image_ids: List[str], prompt_file: str, models: List[str] = None,
+                  model_configs: Dict[str, ProcessingConfig] = None, output_dir: str = "benchmark_data",
+                  schedule: str = "model-major", prefetch: int = 2, shard: Tuple[int, int] = None,
+                  budget: float = None):
+    model_configs = model_configs or MODEL_CONFIGS
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Create directories for each model
+    for model in model_configs.keys():
+        model_dir = output_dir / model
+        model_dir.mkdir(exist_ok=True)
+    
+    # Filter models if specified
+    models_to_run = {k: v for k, v in model_configs.items() if models is None or k in models}
     
-    # Save overall benchmark results
-    with open(output_dir / "benchmark_summary.json", 'w') as f:
-        json.dump(benchmark_results, f, indent=2)
+    if shard:
+        image_ids = select_shard(image_ids, shard)
+        print(f"Shard {shard[0]}/{shard[1]}: {len(image_ids)} images")
+
+    guard = budget_guard(budget, models_to_run, len(image_ids)) if budget is not None else None
+
+    processors = {name: ImageProcessor(config, prompt_file) for name, config in models_to_run.items()}
+    if schedule == "image-major":
+        model_stats = _run_image_major(processors, image_ids, output_dir, prefetch, guard)
+    elif schedule == "model-major":
+        model_stats = _run_model_major(processors, image_ids, output_dir, guard)
+    else:
+        raise ValueError(f"Unknown schedule: {schedule}")
+    if guard and guard.stopped:
+        # Completed results are kept and summarised below; the rest of the run is skipped
+        print(f"\nStopped early: the next request would exceed the ${budget:.4f} budget (spent ${guard.spent:.4f})")
+
+    if shard:
+        # Shards leave the shared summary alone; `merge` combines their raw stats
+        partial_file = shard_file(output_dir, shard)
+        partial_file.parent.mkdir(exist_ok=True)
+        with file_lock(partial_file):
+            partial = load_summary(partial_file) or {"shard": list(shard), "image_ids": image_ids, "models": {}}
+            partial["models"].update({name: stats.to_dict() for name, stats in model_stats.items()})
+            write_json_atomic(partial_file, partial)
+        print(f"Saved shard statistics to {partial_file}")
+        return {name: stats.get_summary() for name, stats in model_stats.items()}
+
+    # Save overall benchmark results, re-reading the summary under a lock so
+    # concurrent runs of other models are not overwritten
+    with span("write_summary"):
+        benchmark_results = update_summary(output_dir / "benchmark_summary.json",
+                                           {name: stats.get_summary() for name, stats in model_stats.items()})
     
     print(f"Updated benchmark summary with {len(benchmark_results)} models")
     
     return benchmark_results
 
+def prompt_hash(prompt_file: str) -> str:
+    with open(prompt_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+def run_prompt_matrix(image_ids: List[str], prompt_files: List[str], models: List[str],
+                      model_configs: Dict[str, ProcessingConfig] = None, output_dir: str = "benchmark_data/prompts",
+                      prefetch: int = 2, budget: float = None) -> Dict[str, Dict[str, Any]]:
+    """Run every prompt file x model cell, sharing image fetching and encoding across cells.
+
+    Results are namespaced by prompt hash: <output_dir>/<hash>/<model>/<image_id>.json,
+    with a benchmark_summary.json and a copy of the prompt in each <hash> directory,
+    and index.json mapping hashes to prompt files. Prompt files with identical
+    content are rejected, since they would share a namespace. With a budget,
+    the run is refused or stopped early as in run_benchmark.
+    """
+    model_configs = model_configs or MODEL_CONFIGS
+    output_dir = Path(output_dir)
+    hashes = {}
+    for prompt_file in prompt_files:
+        digest = prompt_hash(prompt_file)
+        duplicates = [other for other, other_digest in hashes.items() if other_digest == digest]
+        if duplicates or prompt_file in hashes:
+            raise ValueError(f"{prompt_file} has the same content as {(duplicates or [prompt_file])[0]}")
+        hashes[prompt_file] = digest
+    cells = {f"{digest}/{model}": model for digest in hashes.values() for model in models}
+
+    guard = None
+    if budget is not None:
+        guard = budget_guard(budget, {model: model_configs[model] for model in models},
+                             len(image_ids) * len(prompt_files), request_models=cells)
+
+    processors = {}
+    for prompt_file, digest in hashes.items():
+        shutil.copyfile(prompt_file, _ensure_dir(output_dir / digest) / "prompt.txt")
+        for model in models:
+            _ensure_dir(output_dir / digest / model)
+            processors[f"{digest}/{model}"] = ImageProcessor(model_configs[model], prompt_file)
+
+    # Cells are keyed "<hash>/<model>", so results land in the namespaced directories
+    cell_stats = _run_image_major(processors, image_ids, output_dir, prefetch, guard)
+    if guard and guard.stopped:
+        print(f"\nStopped early: the next request would exceed the ${budget:.4f} budget (spent ${guard.spent:.4f})")
+
+    results = {}
+    for prompt_file, digest in hashes.items():
+        results[digest] = update_summary(output_dir / digest / "benchmark_summary.json", {
+            model: cell_stats[f"{digest}/{model}"].get_summary() for model in models
+        })
+    with file_lock(output_dir / "index.json"):
+        index = load_summary(output_dir / "index.json")
+        index.update({digest: prompt_file for prompt_file, digest in hashes.items()})
+        write_json_atomic(output_dir / "index.json", index)
+    return results
+
+def _ensure_dir(path: Path) -> Path:
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def merge_shards(sources: List[str], output_dir: str = "benchmark_data") -> Dict[str, Any]:
+    """Combine shard statistics into the benchmark summary.
+
+    Each source is a shard file or a benchmark_data directory (for example
+    one copied back from another machine). Result files found next to a
+    shard in another directory are copied into `output_dir`.
+    """
+    output_dir = Path(output_dir)
+    shard_files = []
+    for source in map(Path, sources):
+        shard_files.extend(sorted((source / SHARD_DIR).glob("*.json")) if source.is_dir() else [source])
+    if not shard_files:
+        raise ValueError(f"No shard files found in {', '.join(sources)}")
+
+    partials = {}
+    for path in shard_files:
+        with open(path) as f:
+            partials[path] = json.load(f)
+
+    # Distinct shards of one split cover each position of the image list exactly
+    # once; image ids can't be compared because test-images.md may repeat an id
+    counts = {partial["shard"][1] for partial in partials.values()}
+    if len(counts) > 1:
+        raise ValueError(f"Shards from different splits ({', '.join(f'/{count}' for count in sorted(counts))}) "
+                         "cannot be merged; remove the stale shard files")
+    seen = {}
+    for path, partial in partials.items():
+        index, count = partial["shard"]
+        if (index, count) in seen:
+            raise ValueError(f"Shard {index}/{count} found twice: {seen[(index, count)]} and {path}")
+        seen[(index, count)] = path
+
+    model_stats: Dict[str, BenchmarkStats] = {}
+    for path, partial in partials.items():
+        # Bring result files from other benchmark_data trees into output_dir
+        source_dir = path.parent.parent
+        for model_name in partial["models"]:
+            if source_dir.resolve() != output_dir.resolve():
+                (output_dir / model_name).mkdir(parents=True, exist_ok=True)
+                for image_id in partial["image_ids"]:
+                    result_file = source_dir / model_name / f"{image_id}.json"
+                    if result_file.exists():
+                        shutil.copy2(result_file, output_dir / model_name / result_file.name)
+
+        for model_name, data in partial["models"].items():
+            model_stats.setdefault(model_name, BenchmarkStats()).merge(BenchmarkStats.from_dict(data))
+
+    count = counts.pop()
+    missing = [i for i in range(1, count + 1) if (i, count) not in seen]
+    if missing:
+        print(f"Warning: missing shards {', '.join(f'{i}/{count}' for i in missing)}")
+
+    print(f"Merged {len(shard_files)} shards for {len(model_stats)} models")
+    return update_summary(output_dir / "benchmark_summary.json",
+                          {name: stats.get_summary() for name, stats in model_stats.items()})
+
+def _with_structured_output(configs: Dict[str, ProcessingConfig]) -> Dict[str, ProcessingConfig]:
+    return {name: replace(config, options={**config.options, "structured_output": True})
+            for name, config in configs.items()}
+
+def _pop_option(args: List[str], flag: str, cast=str, default=None):
+    """Remove `flag value` from args and return the cast value, or default if absent"""
+    if flag not in args:
+        return default
+    index = args.index(flag)
+    value = cast(args[index + 1])
+    del args[index:index + 2]
+    return value
+
+def _pop_shard(args: List[str]) -> Tuple[Tuple[int, int], bool]:
+    """Remove `--shard i/N` from args; returns the shard (or None) and whether it was valid"""
+    try:
+        return _pop_option(args, "--shard", parse_shard), True
+    except ValueError as e:
+        print(str(e))
+        return None, False
+
+def _validate_models(models: List[str]):
+    """Exit with the list of valid models if any of `models` is unknown"""
+    invalid_models = [m for m in models if m not in MODEL_CONFIGS]
+    if invalid_models:
+        print(f"Invalid models: {', '.join(invalid_models)}")
+        print(f"Choose from: {', '.join(MODEL_CONFIGS.keys())}")
+        sys.exit(1)
+
+def _read_image_ids(images_file: str = "test-images.md") -> List[str]:
+    with open(images_file, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _run_within_budget(run, *args, **kwargs):
+    """Call `run`, exiting with status 2 if it refuses to start because of its budget"""
+    try:
+        return run(*args, **kwargs)
+    except BudgetExceeded as e:
+        print(f"Not starting: {str(e)}")
+        sys.exit(2)
+
 def main():
+    # Opt-in tracing, available in every mode
+    trace_file = _pop_option(sys.argv, "--trace", default=os.environ.get("BENCHMARK_TRACE"))
+    if trace_file:
+        enable_tracing(trace_file)
+
+    # Constrain outputs to annotation_schema.json where the provider supports it
+    model_configs = MODEL_CONFIGS
+    if "--structured" in sys.argv:
+        sys.argv.remove("--structured")
+        model_configs = _with_structured_output(MODEL_CONFIGS)
+
     if len(sys.argv) < 2:
-        print("Usage: python3 process_images.py <mode> [args...]")
+        print("Usage: python3 process_images.py <mode> [args...] [--trace <file.json|file.jsonl>] [--structured]")
         print("Modes:")
         print("  single <model> <image_id> <prompt_file>")
-        print("  benchmark <prompt_file>")
+        print("  benchmark <prompt_file> [model1 model2 ...] [--schedule model-major|image-major] [--prefetch N]")
+        print("  replay <prompt_file> [model1 model2 ...] [--latency S] [--jitter S] [--error-rate P] [--rate-limit RPS] [--seed N]")
+        print("         [--schedule model-major|image-major] [--prefetch N]")
+        print("  (benchmark and replay also accept --shard i/N to process every Nth image, starting at i)")
+        print("  (--budget USD refuses a run projected to exceed it, and stops before a request that would)")
+        print("  plan [model1 model2 ...] [--images FILE] [--concurrency N] [--budget USD] [--rpm N] [--tpm N]")
+        print("  merge [--output-dir DIR] [shard_file_or_dir ...]")
+        print("  matrix <prompt_file1> <prompt_file2> ... [--models m1,m2] [--prefetch N] [--replay] [--budget USD]")
+        print("  cascade <prompt_file> --cheap <model> --strong <model> [--check <model>] [--min-fields N] [--min-agreement X] [--replay] [--budget USD]")
         sys.exit(1)
 
     mode = sys.argv[1]
@@ -315,7 +429,7 @@ def main():
         prompt_file = sys.argv[4]
 
         # Process the single image
-        processor = ImageProcessor(MODEL_CONFIGS[model], prompt_file)
+        processor = ImageProcessor(model_configs[model], prompt_file)
         result = processor.process_images(image_id)
         
         # Save the result to the model's directory
@@ -328,59 +442,163 @@ def main():
         with open(output_file, 'w') as f:
             json.dump(result, f, indent=2)
         
-        # Update the benchmark summary with this result
-        summary_file = output_dir / "benchmark_summary.json"
-        benchmark_results = {}
-        
-        # Load existing summary if it exists
-        if summary_file.exists():
-            try:
-                with open(summary_file, 'r') as f:
-                    benchmark_results = json.load(f)
-                print(f"Loaded existing benchmark summary with {len(benchmark_results)} models")
-            except json.JSONDecodeError:
-                print("Warning: Existing benchmark summary is invalid, creating new one")
-        
-        # Create or update stats for this model
+        # Create or update stats for this model in the shared benchmark summary
         stats = BenchmarkStats()
         stats.update(result)
-        benchmark_results[model] = stats.get_summary()
-        
-        # Save updated benchmark summary
-        with open(summary_file, 'w') as f:
-            json.dump(benchmark_results, f, indent=2)
+        update_summary(output_dir / "benchmark_summary.json", {model: stats.get_summary()})
         
         print(f"Updated benchmark summary for model {model}")
         print(json.dumps(result, indent=4))
         
     elif mode == "benchmark":
-        if len(sys.argv) < 3:
-            print("Usage: python3 process_images.py benchmark <prompt_file> [model1 model2 ...]")
+        args = sys.argv[2:]
+        schedule = _pop_option(args, "--schedule", default="model-major")
+        prefetch = _pop_option(args, "--prefetch", int, 2)
+        shard, valid_shard = _pop_shard(args)
+        budget = _pop_option(args, "--budget", float)
+        if not args or schedule not in ("model-major", "image-major") or prefetch < 0 or not valid_shard:
+            print("Usage: python3 process_images.py benchmark <prompt_file> [model1 model2 ...] [--schedule model-major|image-major] [--prefetch N] [--shard i/N] [--budget USD]")
             sys.exit(1)
             
-        prompt_file = sys.argv[2]
-        models = sys.argv[3:] if len(sys.argv) > 3 else None
+        prompt_file = args[0]
+        models = args[1:] or None
         
-        if models:
-            invalid_models = [m for m in models if m not in MODEL_CONFIGS]
-            if invalid_models:
-                print(f"Invalid models: {', '.join(invalid_models)}")
-                print(f"Choose from: {', '.join(MODEL_CONFIGS.keys())}")
-                sys.exit(1)
-        
-        # Read image IDs from test-images.md
-        with open("test-images.md", 'r') as f:
-            image_ids = [line.strip() for line in f if line.strip()]
+        _validate_models(models or [])
+        image_ids = _read_image_ids()
         
         # Run benchmark
-        benchmark_results = run_benchmark(image_ids, prompt_file, models)
+        benchmark_results = _run_within_budget(run_benchmark, image_ids, prompt_file, models,
+                                               model_configs=model_configs, schedule=schedule, prefetch=prefetch,
+                                               shard=shard, budget=budget)
         
         # Print summary
         print("\nBenchmark Summary:")
         print(json.dumps(benchmark_results, indent=2))
+
+    elif mode == "replay":
+        # Offline run serving recorded responses from benchmark_data, written to benchmark_data/replay
+        args = sys.argv[2:]
+        schedule = _pop_option(args, "--schedule", default="model-major")
+        prefetch = _pop_option(args, "--prefetch", int, 2)
+        shard, valid_shard = _pop_shard(args)
+        budget = _pop_option(args, "--budget", float)
+        if not args or schedule not in ("model-major", "image-major") or prefetch < 0 or not valid_shard:
+            print("Usage: python3 process_images.py replay <prompt_file> [model1 model2 ...] [--latency S] [--jitter S] [--error-rate P] [--rate-limit RPS] [--seed N]")
+            print("       [--schedule model-major|image-major] [--prefetch N] [--shard i/N] [--budget USD]")
+            sys.exit(1)
+
+        options = {}
+        for flag, key, cast in [("--latency", "latency", float), ("--jitter", "jitter", float),
+                                ("--error-rate", "error_rate", float), ("--rate-limit", "rate_limit", float),
+                                ("--seed", "seed", int)]:
+            value = _pop_option(args, flag, cast)
+            if value is not None:
+                options[key] = value
+
+        prompt_file = args[0]
+        models = args[1:] or list(MODEL_CONFIGS.keys())
+        _validate_models(models)
+        image_ids = _read_image_ids()
+
+        replay_configs = {model: replay_config(model, **options) for model in models}
+        start_time = time.time()
+        _run_within_budget(run_benchmark, image_ids, prompt_file, model_configs=replay_configs,
+                           output_dir="benchmark_data/replay", schedule=schedule, prefetch=prefetch,
+                           shard=shard, budget=budget)
+        elapsed = time.time() - start_time
+        requests = len(select_shard(image_ids, shard) if shard else image_ids) * len(models)
+        print(f"\nReplayed {requests} requests in {elapsed:.2f}s ({requests / max(elapsed, 1e-9):.2f} requests/s)")
         
+    elif mode == "cascade":
+        from cascade import CascadeConfig, run_cascade, compare_cascade, print_report
+        args = sys.argv[2:]
+        replay = "--replay" in args
+        if replay:
+            args.remove("--replay")
+        cheap = _pop_option(args, "--cheap")
+        strong = _pop_option(args, "--strong")
+        check = _pop_option(args, "--check")
+        min_fields = _pop_option(args, "--min-fields", int, 5)
+        min_agreement = _pop_option(args, "--min-agreement", float, 0.6)
+        budget = _pop_option(args, "--budget", float)
+        if len(args) != 1 or not cheap or not strong:
+            print("Usage: python3 process_images.py cascade <prompt_file> --cheap <model> --strong <model> [--check <model>] [--min-fields N] [--min-agreement X] [--replay] [--budget USD]")
+            sys.exit(1)
+        _validate_models([m for m in (cheap, strong, check) if m])
+        image_ids = _read_image_ids()
+
+        # --replay serves the stages from recorded results, to tune thresholds offline
+        configs = {name: replay_config(name) for name in MODEL_CONFIGS} if replay else model_configs
+        cascade_dir = "benchmark_data/replay/cascade" if replay else "benchmark_data/cascade"
+        cascade = CascadeConfig(cheap=cheap, strong=strong, check=check,
+                                min_fields=min_fields, min_agreement=min_agreement)
+        processors = {name: ImageProcessor(configs[name], args[0]) for name in cascade.stages()}
+        cascade_summary = _run_within_budget(run_cascade, image_ids, cascade, processors, cascade_dir, budget)
+        print("\nCascade Summary:")
+        print(json.dumps(cascade_summary, indent=2))
+        print_report(compare_cascade(cascade, cascade_summary, cascade_dir, replay=replay))
+
+    elif mode == "matrix":
+        args = sys.argv[2:]
+        replay = "--replay" in args
+        if replay:
+            args.remove("--replay")
+        models = _pop_option(args, "--models", lambda value: value.split(','), list(MODEL_CONFIGS.keys()))
+        prefetch = _pop_option(args, "--prefetch", int, 2)
+        budget = _pop_option(args, "--budget", float)
+        if not args or prefetch < 0:
+            print("Usage: python3 process_images.py matrix <prompt_file1> <prompt_file2> ... [--models m1,m2] [--prefetch N] [--replay] [--budget USD]")
+            sys.exit(1)
+        _validate_models(models)
+        image_ids = _read_image_ids()
+
+        configs = {name: replay_config(name) for name in models} if replay else model_configs
+        output_dir = "benchmark_data/replay/prompts" if replay else "benchmark_data/prompts"
+        try:
+            matrix_results = _run_within_budget(run_prompt_matrix, image_ids, args, models, configs, output_dir,
+                                                prefetch, budget)
+        except ValueError as e:
+            # Prompt files with identical content
+            print(str(e))
+            sys.exit(1)
+        print("\nPrompt Matrix Summary:")
+        print(json.dumps(matrix_results, indent=2))
+        print(f"Compare variants with: python3 analysis_script.py --compare-prompts {output_dir}")
+
+    elif mode == "plan":
+        # Pre-flight estimate from the results already in benchmark_data; nothing is sent to providers
+        args = sys.argv[2:]
+        images_file = _pop_option(args, "--images", default="test-images.md")
+        concurrency = _pop_option(args, "--concurrency", int, 1)
+        budget = _pop_option(args, "--budget", float)
+        rpm = _pop_option(args, "--rpm", int)
+        tpm = _pop_option(args, "--tpm", int)
+        models = args or list(model_configs.keys())
+        _validate_models(models)
+        image_ids = _read_image_ids(images_file)
+
+        # --rpm/--tpm override the configured provider limits for every model
+        limits = {key: value for key, value in (("requests_per_minute", rpm), ("tokens_per_minute", tpm)) if value}
+        configs = {model: replace(model_configs[model], **limits) for model in models}
+        plan = plan_run(configs, len(image_ids), concurrency)
+        print_plan(plan)
+        if budget is not None:
+            if plan["expected_cost"] > budget:
+                print(f"\nOver budget: expected ${plan['expected_cost']:.4f} > ${budget:.4f}")
+                sys.exit(2)
+            print(f"\nWithin budget: expected ${plan['expected_cost']:.4f} <= ${budget:.4f}"
+                  + (f" (p90 ${plan['p90_cost']:.4f} exceeds it)" if plan["p90_cost"] > budget else ""))
+
+    elif mode == "merge":
+        args = sys.argv[2:]
+        output_dir = _pop_option(args, "--output-dir", default="benchmark_data")
+        merged = merge_shards(args or [output_dir], output_dir)
+        print("\nMerged Summary:")
+        print(json.dumps(merged, indent=2))
+
     else:
         print(f"Invalid mode: {mode}")
         sys.exit(1)
 
 if __name__ == "__main__":
+    main()
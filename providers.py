@@ -0,0 +1,344 @@
+"""Provider adapters for process_images.py, registered by api_type.
+
+Each adapter turns a prompt and a front/back image pair into a
+ProviderResponse. The SDK for a provider is only imported when its adapter
+is instantiated. The `replay` adapter serves recorded responses from
+benchmark_data so the harness can be exercised offline.
+"""
+import json
+import time
+import base64
+import random
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Any, Type
+from models_config import ProcessingConfig
+from tracing import span
+from annotation_schema import load_schema, to_gemini_schema
+
+IIIF_URL = "https://iiif.itatti.harvard.edu/iiif/2/digiteca!{}_{:d}.jpg/full/1024,1024/0/default.jpg"
+
+@dataclass
+class ProviderResponse:
+    content: str
+    input_tokens: int
+    output_tokens: int
+    total_tokens: int
+
+class ImageRequest:
+    """Front and back images for one image id, downloaded on first use"""
+
+    def __init__(self, image_id: str):
+        self.image_id = image_id
+        self.photo_id = image_id.split('!')[1]
+        self.urls = [IIIF_URL.format(image_id, side) for side in (1, 2)]
+        self._data: Dict[int, bytes] = {}
+        self._base64: Dict[int, str] = {}
+        # Shared by all models in image-major runs, so downloads happen once
+        self._lock = threading.Lock()
+
+    def get_bytes(self, index: int) -> bytes:
+        with self._lock:
+            if index not in self._data:
+                import httpx
+                with span("fetch_image", image_id=self.image_id, side=index + 1):
+                    response = httpx.get(self.urls[index])
+                    # Raise before caching, so a retry downloads again instead of reusing an error page
+                    response.raise_for_status()
+                    self._data[index] = response.content
+            return self._data[index]
+
+    def prefetch(self):
+        for index in range(len(self.urls)):
+            self.get_bytes(index)
+
+    def release(self):
+        """Drop the downloaded bytes once every consumer is done"""
+        with self._lock:
+            self._data.clear()
+            self._base64.clear()
+
+    def get_base64(self, index: int) -> str:
+        data = self.get_bytes(index)
+        with self._lock:
+            # Encoded once and shared by every consumer of this pair (e.g. all prompt variants)
+            if index not in self._base64:
+                with span("encode_base64", image_id=self.image_id, side=index + 1):
+                    self._base64[index] = base64.b64encode(data).decode("utf-8")
+            return self._base64[index]
+
+PROVIDER_ADAPTERS: Dict[str, Type["ProviderAdapter"]] = {}
+
+def register_adapter(api_type: str):
+    """Class decorator registering an adapter for an api_type"""
+    def decorator(cls):
+        cls.api_type = api_type
+        PROVIDER_ADAPTERS[api_type] = cls
+        return cls
+    return decorator
+
+def get_adapter(config: ProcessingConfig) -> "ProviderAdapter":
+    if config.api_type not in PROVIDER_ADAPTERS:
+        raise ValueError(f"Unsupported api_type: {config.api_type}")
+    return PROVIDER_ADAPTERS[config.api_type](config)
+
+class ProviderAdapter:
+    api_type: str = None
+    key_file: str = None
+    # Whether requests send image bytes (True) or only the IIIF URLs (False)
+    needs_image_bytes: bool = True
+
+    def __init__(self, config: ProcessingConfig):
+        self.config = config
+        self.client = self.setup_client()
+
+    def read_key(self) -> str:
+        with open(self.key_file, "r") as f:
+            return f.read().strip()
+
+    def setup_client(self):
+        raise NotImplementedError
+
+    def generate(self, prompt: str, images: ImageRequest) -> ProviderResponse:
+        raise NotImplementedError
+
+    @property
+    def structured_output(self) -> bool:
+        """Constrain output to the annotation schema (ProcessingConfig.options['structured_output'])"""
+        return bool(self.config.options.get('structured_output'))
+
+    def annotation_schema(self) -> Dict[str, Any]:
+        return {key: value for key, value in load_schema().items() if key not in ('$schema', 'title')}
+
+    def provider_span(self, images: ImageRequest):
+        """Tracing span around the provider call itself, excluding image I/O"""
+        return span("provider_call", image_id=images.image_id, model=self.config.model, api_type=self.api_type)
+
+@register_adapter('openai')
+class OpenAIAdapter(ProviderAdapter):
+    key_file = "key.secret"
+    needs_image_bytes = False
+
+    def setup_client(self):
+        from openai import OpenAI
+        return OpenAI(api_key=self.read_key())
+
+    def generate(self, prompt: str, images: ImageRequest) -> ProviderResponse:
+        response_format = {"type": "json_object"}
+        if self.structured_output:
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {"name": "photograph_annotations", "schema": self.annotation_schema(), "strict": False}
+            }
+
+        # OpenAI fetches the images itself, so only the URLs are sent
+        with self.provider_span(images):
+            response = self.client.chat.completions.create(
+                model=self.config.model,
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": images.urls[0]}},
+                        {"type": "image_url", "image_url": {"url": images.urls[1]}}
+                    ]
+                }],
+                response_format=response_format
+            )
+        input_tokens = response.usage.prompt_tokens
+        output_tokens = response.usage.completion_tokens
+        return ProviderResponse(
+            content=response.choices[0].message.content,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens
+        )
+
+@register_adapter('claude')
+class ClaudeAdapter(ProviderAdapter):
+    key_file = "claudekey.secret"
+
+    def setup_client(self):
+        from anthropic import Anthropic
+        return Anthropic(api_key=self.read_key())
+
+    def generate(self, prompt: str, images: ImageRequest) -> ProviderResponse:
+        img1_data = images.get_base64(0)
+        img2_data = images.get_base64(1)
+
+        # Structured output is a forced tool call whose input follows the schema
+        tool_params = {}
+        if self.structured_output:
+            tool_params = {
+                "tools": [{
+                    "name": "record_annotations",
+                    "description": "Record the transcribed photograph annotations.",
+                    "input_schema": self.annotation_schema()
+                }],
+                "tool_choice": {"type": "tool", "name": "record_annotations"}
+            }
+
+        with self.provider_span(images):
+            response = self.client.messages.create(
+                model=self.config.model,
+                max_tokens=8192,
+                **tool_params,
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image", "source": {
+                            "type": "base64",
+                            "media_type": "image/jpeg",
+                            "data": img1_data
+                        }},
+                        {"type": "image", "source": {
+                            "type": "base64",
+                            "media_type": "image/jpeg",
+                            "data": img2_data
+                        }}
+                    ]
+                }]
+            )
+        if self.structured_output:
+            content = next(json.dumps(block.input) for block in response.content if block.type == "tool_use")
+        else:
+            content = response.content[0].text
+        input_tokens = response.usage.input_tokens
+        output_tokens = response.usage.output_tokens
+        return ProviderResponse(
+            content=content,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens
+        )
+
+@register_adapter('gemini')
+class GeminiAdapter(ProviderAdapter):
+    key_file = "geminikey.secret"
+
+    def setup_client(self):
+        import google.generativeai as genai
+        genai.configure(api_key=self.read_key())
+        # Safety settings can be adjusted if needed
+        safety_settings = [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+        ]
+        return genai.GenerativeModel(
+            self.config.model,
+            safety_settings=safety_settings
+        )
+
+    def generate(self, prompt: str, images: ImageRequest) -> ProviderResponse:
+        import google.generativeai as genai
+
+        prompt_parts = [
+            prompt,
+            {"mime_type": "image/jpeg", "data": images.get_bytes(0)},
+            {"mime_type": "image/jpeg", "data": images.get_bytes(1)}
+        ]
+
+        # Specify JSON output format
+        schema_params = {"response_schema": to_gemini_schema(self.annotation_schema())} if self.structured_output else {}
+        generation_config = genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            **schema_params
+        )
+
+        with self.provider_span(images):
+            response = self.client.generate_content(
+                prompt_parts,
+                generation_config=generation_config
+            )
+        # Note: Gemini API might not always return token counts reliably for multimodal inputs yet.
+        # Using 0 as fallback if not present.
+        input_tokens = getattr(response.usage_metadata, 'prompt_token_count', 0)
+        output_tokens = getattr(response.usage_metadata, 'candidates_token_count', 0)
+        return ProviderResponse(
+            content=response.text,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=getattr(response.usage_metadata, 'total_token_count', input_tokens + output_tokens)
+        )
+
+class ReplayError(Exception):
+    """Synthetic provider failure raised by the replay adapter"""
+
+class ReplayThrottled(ReplayError):
+    """Synthetic rate-limit rejection raised by the replay adapter"""
+
+@register_adapter('replay')
+class ReplayAdapter(ProviderAdapter):
+    """Serve recorded responses from benchmark_data/<source_model>.
+
+    Options (ProcessingConfig.options):
+        source_model: benchmark_data subdirectory to replay
+        source_dir: root of the recorded results (default benchmark_data)
+        latency: mean synthetic latency in seconds
+        jitter: latency is drawn uniformly from latency +/- jitter
+        error_rate: probability that a request fails with ReplayError
+        rate_limit: requests per second before ReplayThrottled is raised
+        seed: makes latency and errors reproducible per image and attempt
+    """
+
+    needs_image_bytes = False
+
+    def setup_client(self):
+        options = self.config.options
+        self.source = Path(options.get('source_dir', 'benchmark_data')) / options['source_model']
+        self.latency = options.get('latency', 0.0)
+        self.jitter = options.get('jitter', 0.0)
+        self.error_rate = options.get('error_rate', 0.0)
+        self.rate_limit = options.get('rate_limit')
+        self.seed = options.get('seed', 0)
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        # Allow a burst of at least one request, so rates below 1/s can still be served
+        self._capacity = max(1.0, self.rate_limit or 0)
+        self._tokens = self._capacity if self.rate_limit else 0.0
+        self._last_refill = time.monotonic()
+        return None
+
+    def _throttle(self):
+        """Token bucket allowing `rate_limit` requests per second"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self.rate_limit)
+            self._last_refill = now
+            if self._tokens < 1:
+                raise ReplayThrottled(f"Rate limit of {self.rate_limit} requests/s exceeded")
+            self._tokens -= 1
+
+    def _random_for(self, image_id: str) -> random.Random:
+        # Seeded per image and attempt so results don't depend on thread scheduling
+        with self._lock:
+            attempt = self._attempts.get(image_id, 0)
+            self._attempts[image_id] = attempt + 1
+        return random.Random(f"{self.seed}:{image_id}:{attempt}")
+
+    def generate(self, prompt: str, images: ImageRequest) -> ProviderResponse:
+        if self.rate_limit:
+            self._throttle()
+
+        rng = self._random_for(images.image_id)
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        with self.provider_span(images):
+            if delay:
+                time.sleep(delay)
+            if rng.random() < self.error_rate:
+                raise ReplayError(f"Synthetic failure for {images.image_id}")
+
+        with open(self.source / f"{images.image_id}.json") as f:
+            recorded = json.load(f)
+
+        annotations = recorded['annotations']
+        return ProviderResponse(
+            content=annotations if isinstance(annotations, str) else json.dumps(annotations),
+            input_tokens=recorded['input_tokens'],
+            output_tokens=recorded['output_tokens'],
+            total_tokens=recorded['total_tokens']
+        )
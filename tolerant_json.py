@@ -0,0 +1,134 @@
+"""Tolerant extraction of the JSON object in a model response.
+
+parse_annotations() tries, in order of cost:
+  1. json.loads on the whole response (the common case); a JSON string,
+     e.g. a double-encoded reply, is parsed again from its text,
+  2. for each `{` in turn (inside a ``` fence if there is one): the object
+     starting there, ignoring any trailing text, or failing that a repair
+     pass that drops trailing commas and closes a truncated document,
+     cutting back to the last complete member if needed.
+Annotations must be a JSON object: any other value is a failure. A repair
+only counts if it keeps at least one value and most of the document; spans
+that neither decode nor repair, such as braces in prose, are skipped. It
+returns the parsed value and one of PARSE_OK, PARSE_REPAIRED or
+PARSE_FAILED; on failure the raw content is returned unchanged.
+"""
+import re
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+PARSE_OK = "ok"
+PARSE_REPAIRED = "repaired"
+PARSE_FAILED = "failed"
+
+# Number of cut points tried, from the end, when repairing a truncated document
+MAX_REPAIR_ATTEMPTS = 50
+# Number of `{` positions tried as the start of the document
+MAX_START_CANDIDATES = 10
+# A repair must keep at least this fraction of the document it was cut from
+MIN_REPAIR_FRACTION = 0.5
+
+_FENCE = re.compile(r"```[a-zA-Z]*\s*\n?(.*?)(?:```|$)", re.DOTALL)
+_START = re.compile(r"\{")
+_decoder = json.JSONDecoder()
+
+def _has_members(value: Any) -> bool:
+    """Whether a value holds anything besides empty objects and arrays"""
+    if isinstance(value, dict):
+        return any(_has_members(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_has_members(item) for item in value)
+    return True
+
+def _repair(text: str) -> List[Tuple[str, float]]:
+    """Candidate repairs of `text`, most complete first, with the fraction of the document each keeps"""
+    out = []
+    closers: List[str] = []
+    # (length of `out` just after a complete member, closers needed at that point)
+    cut_points: List[Tuple[int, str]] = []
+    in_string = escape = False
+
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in '{[':
+            closers.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            # Drop a trailing comma before the closing bracket
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if closers:
+                closers.pop()
+            out.append(ch)
+            cut_points.append((len(out), ''.join(reversed(closers))))
+            if not closers:
+                break
+            continue
+        elif ch == ',':
+            cut_points.append((len(out), ''.join(reversed(closers))))
+        out.append(ch)
+
+    candidates = []
+    tail = ''.join(out)
+    if in_string:
+        # Close the unterminated string, dropping a dangling escape
+        tail = (tail[:-1] if escape else tail) + '"'
+    candidates.append((tail.rstrip().rstrip(',') + ''.join(reversed(closers)), 1.0))
+    for length, closing in reversed(cut_points[-MAX_REPAIR_ATTEMPTS:]):
+        candidates.append((''.join(out[:length]).rstrip().rstrip(',') + closing, length / len(out)))
+    return candidates
+
+def _is_annotations(value: Any) -> bool:
+    return isinstance(value, dict) and _has_members(value)
+
+def _parse_from(text: str, start: int) -> Optional[Dict[str, Any]]:
+    """The object starting at `start`, decoded or repaired, or None"""
+    try:
+        value, _ = _decoder.raw_decode(text, start)
+        return value if _is_annotations(value) else None
+    except json.JSONDecodeError:
+        pass
+
+    for candidate, kept in _repair(text[start:]):
+        if kept < MIN_REPAIR_FRACTION:
+            break
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return value if _is_annotations(value) else None
+    return None
+
+def parse_annotations(content: str) -> Tuple[Any, str]:
+    if not isinstance(content, str):
+        return content, PARSE_FAILED
+    try:
+        value = json.loads(content)
+    except json.JSONDecodeError:
+        text = content
+    else:
+        if isinstance(value, dict):
+            return value, PARSE_OK
+        if not isinstance(value, str):
+            return content, PARSE_FAILED
+        # Double-encoded: the annotations are inside the JSON string
+        text = value
+
+    fenced = _FENCE.search(text)
+    text = fenced.group(1) if fenced else text
+    for match in list(_START.finditer(text))[:MAX_START_CANDIDATES]:
+        value = _parse_from(text, match.start())
+        if value is not None:
+            return value, PARSE_REPAIRED
+    return content, PARSE_FAILED
@@ -0,0 +1,144 @@
+"""Opt-in tracing spans and profiling hooks.
+
+Tracing is off unless enable_tracing() is called (process_images.py does so
+for `--trace <file>` or the BENCHMARK_TRACE environment variable). Spans are
+written as one JSON object per line when the file ends in .jsonl, otherwise
+as Chrome trace-event JSON that can be opened in chrome://tracing or
+https://ui.perfetto.dev.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import contextlib
+from collections import Counter
+from typing import Any, Dict, List, Callable, Optional
+
+class Tracer:
+    def __init__(self, path: str):
+        self.path = path
+        self.events: List[Dict[str, Any]] = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float, attributes: Dict[str, Any], error: Optional[str]):
+        event = {
+            "name": name,
+            "start": round(start - self.origin, 6),
+            "duration": round(end - start, 6),
+            "thread": threading.current_thread().name,
+            "attributes": attributes
+        }
+        if error:
+            event["error"] = error
+        with self._lock:
+            self.events.append(event)
+
+    def flush(self):
+        with self._lock:
+            events = list(self.events)
+        with open(self.path, 'w') as f:
+            if self.path.endswith('.jsonl'):
+                for event in events:
+                    f.write(json.dumps(event, default=str) + "\n")
+            else:
+                json.dump({"traceEvents": [self._chrome_event(event) for event in events]}, f, default=str)
+
+    def _chrome_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        args = dict(event["attributes"])
+        if "error" in event:
+            args["error"] = event["error"]
+        return {
+            "name": event["name"],
+            "ph": "X",
+            "ts": event["start"] * 1_000_000,
+            "dur": event["duration"] * 1_000_000,
+            "pid": os.getpid(),
+            "tid": event["thread"],
+            "args": args
+        }
+
+_tracer: Optional[Tracer] = None
+
+def enable_tracing(path: str) -> Tracer:
+    """Start recording spans; they are written to `path` at exit"""
+    global _tracer
+    _tracer = Tracer(path)
+    atexit.register(_tracer.flush)
+    return _tracer
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Time a block as a named span; a no-op when tracing is disabled"""
+    if _tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _tracer.record(name, start, time.perf_counter(), attributes, error)
+
+class StackSampler:
+    """Sample the calling thread's stack on an interval from a background thread"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        """Write collapsed stacks, as consumed by flamegraph.pl and speedscope"""
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+def profile_call(func: Callable, profile_path: str = None, sample_path: str = None):
+    """Call func() under cProfile and/or the stack sampler, writing the results to the given paths"""
+    profiler = sampler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if sample_path:
+        sampler = StackSampler()
+        sampler.start()
+    try:
+        return func()
+    finally:
+        if sampler:
+            sampler.stop()
+            sampler.write(sample_path)
+            print(f"Wrote {sum(sampler.samples.values())} stack samples to {sample_path}")
+        if profiler:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"Wrote cProfile stats to {profile_path}")
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)